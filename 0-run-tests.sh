@@ -1,3 +1,9 @@
 #!/bin/bash
 set -eo pipefail
+# Offline tests, against the in-process game store
+python3 function/item_diff.test.py
+python3 function/game_store.test.py
+python3 function/model.test.py
+python3 function/game_flow.test.py
+# Live test, against the deployed function's AWS account
 python3 function/lambda_function.test.py
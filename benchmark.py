@@ -0,0 +1,392 @@
+"""
+Offline microbenchmarks for the Disastle rules engine and serialization.
+Runs against small, medium and large castle fixtures built from a fixed
+seed, so results are comparable between runs on the same machine.
+
+    $ python benchmark.py --save baseline.json
+    $ python benchmark.py --compare baseline.json
+"""
+import argparse
+import copy
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "function"))
+
+import manager  # noqa: E402
+from batch import CastleBatch  # noqa: E402
+from data.disaster_list import DISASTER_LIST  # noqa: E402
+from forecast import DisasterForecast  # noqa: E402
+from model import Castle, Game  # noqa: E402
+from simulate import (  # noqa: E402
+    NUM_CATASTROPHES,
+    NUM_DISASTERS,
+    NUM_SAFE,
+    build_castle,
+    new_game,
+    players_info,
+)
+
+# Rooms placed in each castle, besides the throne room
+FIXTURE_SIZES = {"small": 5, "medium": 15, "large": 30}
+FIXTURE_SEED = 0
+NUM_PLAYERS = 4
+# Castles stacked into the batched link count benchmarks
+BATCH_CASTLES = 1000
+# Timed rounds per benchmark and the minimum time each round runs for
+ROUNDS = 5
+ROUND_TIME = 0.05
+# Cap on calls per round of benchmarks that need a fresh setup per call
+FRESH_CALLS = 200
+# Slowdown of the fastest round against the baseline reported as a
+# regression. The minimum is compared as it is the least noisy.
+DEFAULT_THRESHOLD = 0.25
+
+
+class Benchmark:
+    """
+    fn is called with the arguments returned by setup. If fresh is set,
+    fn mutates its arguments, so setup runs before every call and only
+    fn is timed.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        fn: Callable,
+        setup: Callable[[], tuple],
+        fresh: bool = False,
+    ):
+        self.name = name
+        self.fn = fn
+        self.setup = setup
+        self.fresh = fresh
+
+    def _round_fresh(self) -> float:
+        elapsed = 0.0
+        calls = 0
+        while elapsed < ROUND_TIME and calls < FRESH_CALLS:
+            args = self.setup()
+            start = time.perf_counter()
+            self.fn(*args)
+            elapsed += time.perf_counter() - start
+            calls += 1
+        return elapsed / calls
+
+    def _round_batched(self, args: tuple, number: int) -> float:
+        fn = self.fn
+        start = time.perf_counter()
+        for _ in range(number):
+            fn(*args)
+        return (time.perf_counter() - start) / number
+
+    def run(self) -> Dict[str, float]:
+        """
+        Minimum and median seconds per call over ROUNDS rounds
+        """
+        if self.fresh:
+            samples = [self._round_fresh() for _ in range(ROUNDS)]
+        else:
+            args = self.setup()
+            number = 1
+            while self._round_batched(args, number) * number < ROUND_TIME:
+                number *= 2
+            samples = [
+                self._round_batched(args, number) for _ in range(ROUNDS)
+            ]
+        return {
+            "min_us": 1e6 * min(samples),
+            "median_us": 1e6 * statistics.median(samples),
+        }
+
+
+def castle_fixture(size: str) -> Castle:
+    castle = Castle(manager.THRONE_ROOM_ID_START)
+    build_castle(castle, FIXTURE_SIZES[size], random.Random(FIXTURE_SEED))
+    return castle
+
+
+def game_fixture(size: str) -> Game:
+    """
+    A started game whose castles all hold the fixture's number of rooms
+    """
+    rng = random.Random(FIXTURE_SEED)
+    game = new_game(NUM_PLAYERS, FIXTURE_SEED)
+    for player in game.players.values():
+        build_castle(player.castle, FIXTURE_SIZES[size], rng)
+    return game
+
+
+def batch_fixture(size: str) -> CastleBatch:
+    """
+    BATCH_CASTLES castles, cycling through the game fixture's castles
+    """
+    castles = [
+        player.castle for player in game_fixture(size).players.values()
+    ]
+    return CastleBatch.from_castles(
+        [castles[i % len(castles)] for i in range(BATCH_CASTLES)]
+    )
+
+
+def disaster_fixture(size: str) -> dict:
+    """
+    JSON of a game with a disaster pending and every player's discard
+    chosen, ready to resolve
+    """
+    game = game_fixture(size)
+    for disaster_id in DISASTER_LIST:
+        if disaster_id[0] != "d":
+            continue
+        game.current_disasters = [disaster_id]
+        for player_id in game.players:
+            options = manager.discard_options(game, player_id)
+            game.players[player_id].discard_list = (
+                options[0] if len(options) > 0 else []
+            )
+        if manager.all_discard_complete(game):
+            return game.to_json_obj()
+    raise RuntimeError("No disaster every castle can survive")
+
+
+def forecast_fixture() -> DisasterForecast:
+    forecast = DisasterForecast(6, 0)
+    forecast.draw_disaster(
+        DISASTER_LIST["d1"]["name"], DISASTER_LIST["d2"]["name"]
+    )
+    return forecast
+
+
+def _place_outer(castle: Castle, room_id: int, placement: tuple):
+    with castle.trial():
+        castle.place(room_id, *placement)
+
+
+def _discard_outer(castle: Castle, room_id: int):
+    with castle.trial():
+        castle.discard(room_id)
+
+
+def _outer_placement(castle: Castle):
+    for room_id in range(1, manager.THRONE_ROOM_ID_START):
+        if castle._data[room_id, 0] == 0:
+            placements = castle.legal_placements(room_id)
+            if placements:
+                return room_id, placements[0]
+    raise RuntimeError("No room can be placed")
+
+
+def _outer_room(castle: Castle) -> int:
+    return next(
+        room_id
+        for room_id in castle.discardable_rooms()
+        if room_id != castle.throne_room_id
+    )
+
+
+def _is_outer_all(castle: Castle, room_ids: List[int]):
+    for room_id in room_ids:
+        castle.is_outer_room(room_id)
+
+
+def benchmarks() -> List[Benchmark]:
+    suite = []
+    for size in FIXTURE_SIZES:
+        castle = castle_fixture(size)
+        game = game_fixture(size)
+        game_json = game.to_json_obj()
+        castles = batch_fixture(size)
+        resolve_json = disaster_fixture(size)
+        suite += [
+            Benchmark(
+                "castle.place[{}]".format(size),
+                _place_outer,
+                lambda c=castle: (c,) + _outer_placement(c),
+            ),
+            Benchmark(
+                "castle.is_outer_room[{}]".format(size),
+                _is_outer_all,
+                lambda c=castle: (c, c.all_rooms().tolist()),
+            ),
+            Benchmark(
+                "castle.num_connections[{}]".format(size),
+                Castle.num_connections,
+                lambda c=castle: (c,),
+            ),
+            Benchmark(
+                "castle.count_connections[{}]".format(size),
+                Castle.count_connections,
+                lambda c=castle: (c,),
+            ),
+            Benchmark(
+                "batch.link_counts[{}]".format(size),
+                CastleBatch.link_counts,
+                lambda b=castles: (b,),
+            ),
+            Benchmark(
+                "castle.discard[{}]".format(size),
+                _discard_outer,
+                lambda c=castle: (c, _outer_room(c)),
+            ),
+            Benchmark(
+                "castle.copy[{}]".format(size),
+                Castle.copy,
+                lambda c=castle: (c,),
+            ),
+            Benchmark(
+                "game.to_json_obj[{}]".format(size),
+                Game.to_json_obj,
+                lambda g=game: (g,),
+            ),
+            Benchmark(
+                "game.from_json_obj[{}]".format(size),
+                Game.from_json_obj,
+                lambda j=game_json: (copy.deepcopy(j),),
+                fresh=True,
+            ),
+            Benchmark(
+                "manager.resolve_disaster[{}]".format(size),
+                manager.resolve_disaster,
+                lambda j=resolve_json: (Game.from_json_obj(copy.deepcopy(j)),),
+                fresh=True,
+            ),
+        ]
+    start_json = game_fixture("small").to_json_obj()
+    info = players_info(NUM_PLAYERS)
+    forecast = forecast_fixture()
+    links = (2, 1, 1)
+    suite += [
+        Benchmark(
+            "manager.create_game",
+            manager.create_game,
+            lambda: (
+                info,
+                NUM_DISASTERS,
+                NUM_CATASTROPHES,
+                NUM_SAFE,
+                FIXTURE_SEED,
+            ),
+        ),
+        Benchmark(
+            "manager.restock_shop",
+            manager.restock_shop,
+            lambda: (Game.from_json_obj(copy.deepcopy(start_json)),),
+            fresh=True,
+        ),
+        Benchmark(
+            "forecast.disasters_prob",
+            DisasterForecast.disasters_prob,
+            lambda: (forecast,),
+        ),
+        Benchmark(
+            "forecast.disaster_distribution",
+            DisasterForecast.disaster_distribution,
+            lambda: (forecast, 60),
+        ),
+        Benchmark(
+            "forecast.damage_distribution",
+            DisasterForecast.damage_distribution,
+            lambda: (forecast, 60, links),
+        ),
+        Benchmark(
+            "forecast.expected_damage",
+            DisasterForecast.expected_damage,
+            lambda: (forecast, 60, links),
+        ),
+    ]
+    return suite
+
+
+def run(name_filter: Optional[str] = None) -> Dict:
+    results = {}
+    for bench in benchmarks():
+        if name_filter is None or name_filter in bench.name:
+            results[bench.name] = bench.run()
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "benchmarks": results,
+    }
+
+
+def compare(report: Dict, baseline: Dict, threshold: float) -> List[str]:
+    """
+    Names of benchmarks whose fastest round is more than threshold slower
+    than in the baseline
+    """
+    regressions = []
+    for name, result in report["benchmarks"].items():
+        if name not in baseline["benchmarks"]:
+            continue
+        before = baseline["benchmarks"][name]["min_us"]
+        change = result["min_us"] / before - 1
+        result["baseline_us"] = before
+        result["change"] = change
+        if change > threshold:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument(
+        "--filter", help="only run benchmarks whose name contains this"
+    )
+    parser.add_argument("--json", action="store_true")
+    parser.add_argument("--save", help="write the results to this file")
+    parser.add_argument(
+        "--compare", help="baseline file written by an earlier --save"
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=DEFAULT_THRESHOLD,
+        help="relative slowdown flagged as a regression",
+    )
+    args = parser.parse_args()
+
+    report = run(args.filter)
+    regressions = []
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.threshold)
+        report["regressions"] = regressions
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print(
+            "{:<36} {:>10} {:>10} {:>10} {:>8}".format(
+                "benchmark", "min(us)", "median(us)", "base(us)", "change"
+            )
+        )
+        for name, result in report["benchmarks"].items():
+            line = "{:<36} {:>10.2f} {:>10.2f}".format(
+                name, result["min_us"], result["median_us"]
+            )
+            if "change" in result:
+                line += " {:>10.2f} {:>+8.1%}".format(
+                    result["baseline_us"], result["change"]
+                )
+                if name in regressions:
+                    line += "  REGRESSION"
+            print(line)
+    if len(regressions) > 0:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,456 @@
+"""
+Contention benchmark for concurrent writes to one game. Sends the same
+kind of request from many clients at once through lambda_handler against
+a local game store, and checks that no client's update was lost.
+
+    $ python contention.py --clients 6
+    $ python contention.py --store sqlite:/tmp/disastle.sqlite3
+    $ python contention.py --endpoint-url http://localhost:8000
+
+The default store is DynamoDB: moto's in-process DynamoDB, with each call
+made atomic like a DynamoDB request, or the DynamoDB at --endpoint-url.
+Every store call is delayed by --latency.
+"""
+import argparse
+import itertools
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Callable, Dict, List
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "function"))
+
+import manager  # noqa: E402
+from model import Game  # noqa: E402
+from simulate import build_castle, new_game  # noqa: E402
+
+TABLE_NAME = "disastle_game"
+# Throne rooms, and so players, a game can have
+MAX_PLAYERS = 10
+CASTLE_ROOMS = 10
+
+
+def _create_table(dynamodb):
+    if TABLE_NAME in [table.name for table in dynamodb.tables.all()]:
+        return
+    dynamodb.create_table(
+        TableName=TABLE_NAME,
+        KeySchema=[
+            {"AttributeName": "id", "KeyType": "HASH"},
+            {"AttributeName": "timestamp", "KeyType": "RANGE"},
+        ],
+        AttributeDefinitions=[
+            {"AttributeName": "id", "AttributeType": "S"},
+            {"AttributeName": "timestamp", "AttributeType": "N"},
+        ],
+        BillingMode="PAY_PER_REQUEST",
+    ).wait_until_exists()
+
+
+@contextmanager
+def local_store(store: str, endpoint_url: str, latency: float):
+    """
+    Points lambda_function at a local game store, with every call to it
+    delayed by latency
+    """
+    os.environ["GAME_STORE"] = store
+    mock = None
+    make_api_call = None
+    if store == "dynamodb":
+        import boto3
+        import botocore.client
+
+        os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+        os.environ.setdefault("AWS_ACCESS_KEY_ID", "local")
+        os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "local")
+        if endpoint_url:
+            os.environ["DYNAMODB_ENDPOINT_URL"] = endpoint_url
+        else:
+            try:
+                from moto import mock_aws
+            except ImportError:
+                sys.exit("moto is needed to run without --endpoint-url")
+            mock = mock_aws()
+            mock.start()
+            # Serializes calls to moto, which unlike DynamoDB does not make
+            # each request atomic
+            moto_lock = threading.Lock()
+            make_api_call = botocore.client.BaseClient._make_api_call
+
+            def atomic_api_call(self, operation, params):
+                with moto_lock:
+                    return make_api_call(self, operation, params)
+
+            botocore.client.BaseClient._make_api_call = atomic_api_call
+        _create_table(boto3.resource("dynamodb", endpoint_url=endpoint_url))
+    try:
+        import lambda_function
+
+        game_store = lambda_function.get_store()
+        call = game_store._call
+
+        def delayed_call(operation, fn, *args):
+            time.sleep(latency)
+            return call(operation, fn, *args)
+
+        game_store._call = delayed_call
+        yield lambda_function
+    finally:
+        if make_api_call is not None:
+            botocore.client.BaseClient._make_api_call = make_api_call
+        if mock is not None:
+            mock.stop()
+
+
+def _all_at_once(events: List[Dict], handler: Callable) -> List[Dict]:
+    """
+    Sends every event from its own thread, released together
+    """
+    barrier = threading.Barrier(len(events))
+
+    def send(event):
+        barrier.wait()
+        return handler(event, None)
+
+    with ThreadPoolExecutor(max_workers=len(events)) as executor:
+        return list(executor.map(send, events))
+
+
+def _lobby(lf, usernames: List[str]) -> Dict:
+    created = lf.lambda_handler(
+        {"action": "CREATE_LOBBY", "username": usernames[0]}, None
+    )
+    players = [created["player_id"]]
+    for username in usernames[1:]:
+        joined = lf.lambda_handler(
+            {
+                "action": "JOIN_LOBBY",
+                "join_code": created["join_code"],
+                "username": username,
+            },
+            None,
+        )
+        players.append(joined["player_id"])
+    return dict(created, players=players)
+
+
+def _item(lf, lobby: Dict) -> Dict:
+    item = lf.get_store().get(lobby["game_id"], lobby["game_timestamp"])
+    return item if item is not None else {}
+
+
+def scenario_join(lf, clients: int) -> Dict:
+    """
+    Every client joins the same lobby
+    """
+    lobby = _lobby(lf, ["host"])
+    results = _all_at_once(
+        [
+            {
+                "action": "JOIN_LOBBY",
+                "join_code": lobby["join_code"],
+                "username": "user{}".format(i),
+            }
+            for i in range(clients)
+        ],
+        lf.lambda_handler,
+    )
+    players = _item(lf, lobby)["players"]
+    joined = [r["player_id"] for r in results if "error" not in r]
+    return {
+        "results": results,
+        "correct": all(player_id in players for player_id in joined)
+        and len(players) == len(joined) + 1,
+    }
+
+
+def scenario_ready(lf, clients: int) -> Dict:
+    """
+    Every player of a lobby picks a different throne room
+    """
+    lobby = _lobby(lf, ["user{}".format(i) for i in range(clients)])
+    results = _all_at_once(
+        [
+            {
+                "action": "READY_LOBBY",
+                "game_id": lobby["game_id"],
+                "game_timestamp": lobby["game_timestamp"],
+                "player_id": player_id,
+                "throne_room_id": manager.THRONE_ROOM_ID_START + i,
+            }
+            for i, player_id in enumerate(lobby["players"])
+        ],
+        lf.lambda_handler,
+    )
+    players = _item(lf, lobby)["players"]
+    ready = [
+        player_id
+        for player_id, result in zip(lobby["players"], results)
+        if "error" not in result
+    ]
+    return {
+        "results": results,
+        "correct": all("throne_room_id" in players[p] for p in ready)
+        and sum("throne_room_id" in p for p in players.values())
+        == len(ready),
+    }
+
+
+def scenario_start(lf, clients: int) -> Dict:
+    """
+    Every player of a ready lobby starts the game; exactly one may win
+    """
+    lobby = _lobby(lf, ["user{}".format(i) for i in range(clients)])
+    for i, player_id in enumerate(lobby["players"]):
+        lf.lambda_handler(
+            {
+                "action": "READY_LOBBY",
+                "game_id": lobby["game_id"],
+                "game_timestamp": lobby["game_timestamp"],
+                "player_id": player_id,
+                "throne_room_id": manager.THRONE_ROOM_ID_START + i,
+            },
+            None,
+        )
+    results = _all_at_once(
+        [
+            {
+                "action": "START_GAME",
+                "game_id": lobby["game_id"],
+                "game_timestamp": lobby["game_timestamp"],
+                "player_id": player_id,
+            }
+            for player_id in lobby["players"]
+        ],
+        lf.lambda_handler,
+    )
+    started = [r for r in results if "error" not in r]
+    # The game item must hold the winner's game, which its snapshot holds
+    game = Game.from_json_obj(_item(lf, lobby))
+    snapshot = lf.load_game_at(lobby["game_id"], 0)
+    return {
+        "results": results,
+        "correct": len(started) == 1
+        and game.to_json_obj() == snapshot.to_json_obj(),
+    }
+
+
+def _disaster_game(lf, clients: int, rng: random.Random) -> Dict:
+    """
+    A stored game with a disaster pending that every player must discard
+    rooms for
+    """
+    game = new_game(clients, rng.randrange(2**32))
+    for player in game.players.values():
+        build_castle(player.castle, CASTLE_ROOMS, rng)
+    disaster_ids = ["d{}".format(i) for i in range(1, 13)]
+    # Later disasters demand more links, so earlier ones are marked drawn
+    # until one hits every castle
+    for num_previous, disaster_id in itertools.product(
+        range(5), disaster_ids
+    ):
+        game.previous_disasters = [
+            d for d in disaster_ids if d != disaster_id
+        ][:num_previous]
+        game.current_disasters = [disaster_id]
+        options = {
+            player_id: manager.discard_options(game, player_id)
+            for player_id in game.players
+        }
+        if all(
+            manager.player_damage(game, player_id) > 0 and options[player_id]
+            for player_id in game.players
+        ):
+            break
+    else:
+        raise RuntimeError("No disaster hits every castle")
+    lobby = {
+        "game_id": str(uuid.uuid4()),
+        "game_timestamp": 1,
+    }
+    lf.get_store().put(
+        dict(
+            game.to_json_obj(),
+            id=lobby["game_id"],
+            timestamp=lobby["game_timestamp"],
+            game_state="PLAYING",
+            snapshot_seq=0,
+            version=1,
+        )
+    )
+    return dict(
+        lobby,
+        game=game,
+        discards={p: options[p][0] for p in game.players},
+    )
+
+
+def scenario_discard(lf, clients: int) -> Dict:
+    """
+    Every player discards for the same disaster at once
+    """
+    fixture = _disaster_game(lf, clients, random.Random(clients))
+    results = _all_at_once(
+        [
+            {
+                "action": "ACTION_DISCARD",
+                "game_id": fixture["game_id"],
+                "game_timestamp": fixture["game_timestamp"],
+                "player_id": player_id,
+                "discard_list": discard_list,
+            }
+            for player_id, discard_list in fixture["discards"].items()
+        ],
+        lf.lambda_handler,
+    )
+    game, seq, _, _ = lf.load_game(
+        fixture["game_id"], fixture["game_timestamp"]
+    )
+    before = fixture["game"]
+    # Rooms are only discarded once everyone has, so the game shows either
+    # every successful discard pending or the disaster resolved
+    discarded = [
+        player_id
+        for player_id, result in zip(fixture["discards"], results)
+        if "error" not in result
+    ]
+    resolved = len(game.current_disasters) == 0
+    if resolved:
+        kept = all(
+            len(game.players[p].castle.all_rooms())
+            == len(before.players[p].castle.all_rooms())
+            - len(fixture["discards"][p])
+            for p in discarded
+        )
+    else:
+        kept = all(len(game.players[p].discard_list) > 0 for p in discarded)
+    return {
+        "results": results,
+        "correct": kept
+        and seq == len(discarded)
+        and resolved == (len(discarded) == clients),
+    }
+
+
+SCENARIOS = {
+    "join": scenario_join,
+    "ready": scenario_ready,
+    "start": scenario_start,
+    "discard": scenario_discard,
+}
+
+
+def run(lf, clients: int, rounds: int) -> Dict:
+    game_store = lf.get_store()
+    report = {}
+    for name, scenario in SCENARIOS.items():
+        seconds = 0.0
+        outcomes: Dict[str, int] = defaultdict(int)
+        correct = True
+        game_store.reset_metrics()
+        for _ in range(rounds):
+            start = time.perf_counter()
+            result = scenario(lf, clients)
+            seconds += time.perf_counter() - start
+            correct = correct and result["correct"]
+            for response in result["results"]:
+                outcomes[response.get("error", "ok")] += 1
+        metrics = game_store.metrics()
+        report[name] = {
+            "clients": clients,
+            "rounds": rounds,
+            "mean_seconds": seconds / rounds,
+            "store_calls": sum(m["count"] for m in metrics.values()),
+            "conditional_failures": sum(
+                m["conflicts"] for m in metrics.values()
+            ),
+            "store_metrics": metrics,
+            "outcomes": dict(outcomes),
+            "correct": correct,
+        }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--clients", type=int, default=6)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=0.005,
+        help="seconds added to each store call",
+    )
+    parser.add_argument(
+        "--store",
+        default="dynamodb",
+        help='"dynamodb", "memory" or "sqlite:<path>"',
+    )
+    parser.add_argument("--endpoint-url", help="local DynamoDB to use")
+    parser.add_argument(
+        "--attempts",
+        type=int,
+        help="override lambda_function.MAX_ATTEMPTS, 1 to disable retries",
+    )
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+    if not 1 < args.clients <= MAX_PLAYERS:
+        parser.error("--clients must be from 2 to {}".format(MAX_PLAYERS))
+
+    with local_store(args.store, args.endpoint_url, args.latency) as lf:
+        if args.attempts is not None:
+            lf.MAX_ATTEMPTS = args.attempts
+        report = run(lf, args.clients, args.rounds)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print(
+            "{:<8} {:>8} {:>7} {:>9} {:>8}  {}".format(
+                "scenario",
+                "mean(s)",
+                "calls",
+                "cond.fail",
+                "correct",
+                "outcomes",
+            )
+        )
+        for name, stats in report.items():
+            print(
+                "{:<8} {:>8.3f} {:>7} {:>9} {:>8}  {}".format(
+                    name,
+                    stats["mean_seconds"],
+                    stats["store_calls"],
+                    stats["conditional_failures"],
+                    str(stats["correct"]),
+                    stats["outcomes"],
+                )
+            )
+        print("\nstore latency (ms)")
+        for name, stats in report.items():
+            for operation, m in stats["store_metrics"].items():
+                print(
+                    "{:<8} {:<7} {:>6} calls  mean {:>7.3f}  p50 {:>7.3f}  "
+                    "p99 {:>7.3f}  max {:>7.3f}".format(
+                        name,
+                        operation,
+                        m["count"],
+                        m["mean_ms"],
+                        m["p50_ms"],
+                        m["p99_ms"],
+                        m["max_ms"],
+                    )
+                )
+    if not all(stats["correct"] for stats in report.values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+import copy
+
+from typing import Dict, Iterable, Optional
+
+import manager
+from model import Game
+
+# A full snapshot of the game is stored every this many actions
+SNAPSHOT_INTERVAL = 10
+
+# Event fields recorded for each game action, in manager argument order
+ACTION_FIELDS = {
+    "ACTION_DISCARD": ("discard_list",),
+    "ACTION_SHOP": ("room_id", "x", "y", "rotation"),
+    "ACTION_MOVE": ("room_id", "x", "y", "rotation"),
+    "ACTION_SWAP": ("room_id_a", "room_id_b", "rotation_a", "rotation_b"),
+}
+
+ACTION_FUNCTIONS = {
+    "ACTION_DISCARD": manager.action_discard,
+    "ACTION_SHOP": manager.action_shop,
+    "ACTION_MOVE": manager.action_move,
+    "ACTION_SWAP": manager.action_swap,
+}
+
+
+def log_id(game_id: str) -> str:
+    """
+    Partition key of a game's action log items
+    """
+    return game_id + "#log"
+
+
+def snapshot_id(game_id: str) -> str:
+    """
+    Partition key of a game's snapshot items
+    """
+    return game_id + "#snapshot"
+
+
+def is_snapshot_due(seq: int) -> bool:
+    return seq % SNAPSHOT_INTERVAL == 0
+
+
+def to_record(event: dict) -> Dict:
+    """
+    The part of a request needed to replay it
+    """
+    record = {"action": event["action"], "player_id": event["player_id"]}
+    for field in ACTION_FIELDS[event["action"]]:
+        record[field] = event[field]
+    return record
+
+
+def apply_action(game_info: Game, record: dict) -> Game:
+    """
+    Applies a recorded action through manager. Numbers are converted since
+    records read back from DynamoDB hold Decimals.
+    """
+    args = []
+    for field in ACTION_FIELDS[record["action"]]:
+        value = record[field]
+        if isinstance(value, list):
+            args.append([int(v) for v in value])
+        else:
+            args.append(int(value))
+    return ACTION_FUNCTIONS[record["action"]](
+        game_info, record["player_id"], *args
+    )
+
+
+def apply_if_legal(game_info: Game, record: dict) -> Optional[Game]:
+    """
+    Applies a recorded action, or returns None if it was rejected: any
+    action but a discard out of the player's turn or while a disaster is
+    pending, or one manager refused. Manager leaves the game untouched when
+    it refuses an action, so the game's state is compared before and after.
+    """
+    if record["action"] != "ACTION_DISCARD" and (
+        game_info.turn_order[game_info.turn_index] != record["player_id"]
+        or len(game_info.current_disasters) > 0
+    ):
+        return None
+    before = copy.deepcopy(game_info.to_json_obj())
+    game_info = apply_action(game_info, record)
+    if game_info.to_json_obj() == before:
+        return None
+    return game_info
+
+
+def replay(game_info: Game, records: Iterable[dict]) -> Game:
+    for record in records:
+        game_info = apply_action(game_info, record)
+    return game_info
@@ -0,0 +1,127 @@
+from decimal import Decimal
+from typing import Callable, Dict, Optional, Tuple
+
+from data.room_list import ROOM_LIST
+
+# Error codes returned as {"error": code, "message": ...} instead of a
+# result. The first three are found by the schema before any handler runs.
+UNKNOWN_ACTION = "UNKNOWN_ACTION"
+MISSING_FIELD = "MISSING_FIELD"
+INVALID_FIELD = "INVALID_FIELD"
+NOT_FOUND = "NOT_FOUND"
+WRONG_STATE = "WRONG_STATE"
+NOT_A_PLAYER = "NOT_A_PLAYER"
+REJECTED = "REJECTED"
+CONFLICT = "CONFLICT"
+
+# Room ids run from 1 up to this, throne rooms included
+MAX_ROOM_ID = max(int(room_id) for room_id in ROOM_LIST)
+
+# Field types a schema can declare, with the check each compiles to
+FIELD_CHECKS: Dict[str, Callable[[object], bool]] = {
+    "str": lambda value: isinstance(value, str) and len(value) > 0,
+    "int": lambda value: _is_int(value),
+    "number": lambda value: _is_number(value),
+    "room_id": lambda value: _is_int(value) and 1 <= value <= MAX_ROOM_ID,
+    "int_list": lambda value: isinstance(value, list)
+    and all(_is_int(v) for v in value),
+}
+
+
+def _is_int(value) -> bool:
+    if isinstance(value, bool):
+        return False
+    if isinstance(value, Decimal):
+        return value == value.to_integral_value()
+    return isinstance(value, int)
+
+
+def _is_number(value) -> bool:
+    return not isinstance(value, bool) and isinstance(
+        value, (int, float, Decimal)
+    )
+
+
+def error(code: str, message: str, **details) -> Dict:
+    return {"error": code, "message": message, **details}
+
+
+class Schema:
+    """
+    Required and optional event fields by type name from FIELD_CHECKS,
+    compiled to a tuple of checks when the action is registered
+    """
+
+    def __init__(
+        self, required: Dict[str, str], optional: Dict[str, str] = None
+    ):
+        optional = optional or {}
+        for type_name in list(required.values()) + list(optional.values()):
+            if type_name not in FIELD_CHECKS:
+                raise RuntimeError("Unknown field type {}".format(type_name))
+        self._checks: Tuple[Tuple[str, Callable, bool], ...] = tuple(
+            (field, FIELD_CHECKS[type_name], True)
+            for field, type_name in required.items()
+        ) + tuple(
+            (field, FIELD_CHECKS[type_name], False)
+            for field, type_name in optional.items()
+        )
+
+    def validate(self, event: dict) -> Optional[Dict]:
+        """
+        Error response for the first bad field, or None if the event is
+        well formed
+        """
+        for field, check, required in self._checks:
+            if field not in event:
+                if required:
+                    return error(
+                        MISSING_FIELD, "Missing " + field, field=field
+                    )
+            elif not check(event[field]):
+                return error(INVALID_FIELD, "Invalid " + field, field=field)
+        return None
+
+
+class Action:
+    def __init__(
+        self, name: str, handler: Callable[[dict], Dict], schema: Schema
+    ):
+        self.name = name
+        self.handler = handler
+        self.schema = schema
+
+
+ACTIONS: Dict[str, Action] = {}
+
+
+def action(
+    name: str, required: Dict[str, str], optional: Dict[str, str] = None
+):
+    """
+    Registers the decorated handler for events whose action is name. The
+    handler only sees events that passed the schema.
+    """
+    schema = Schema(required, optional)
+
+    def register(handler: Callable[[dict], Dict]):
+        if name in ACTIONS:
+            raise RuntimeError("Action {} registered twice".format(name))
+        ACTIONS[name] = Action(name, handler, schema)
+        return handler
+
+    return register
+
+
+def dispatch(event) -> Dict:
+    if (
+        not isinstance(event, dict)
+        or not isinstance(event.get("action"), str)
+        or event["action"] not in ACTIONS
+    ):
+        return error(UNKNOWN_ACTION, "Unknown action")
+    registered = ACTIONS[event["action"]]
+    problem = registered.schema.validate(event)
+    if problem is not None:
+        return problem
+    return registered.handler(event)
@@ -0,0 +1,82 @@
+import numpy as np
+
+from typing import Sequence
+
+from model import Castle, ROOM_CONNECTIONS, LINK_KINDS
+
+
+def disaster_damage(links: np.array, requirements: np.array) -> np.array:
+    """
+    Damage dealt to each castle given its (diamond, cross, moon, wild) link
+    counts, one row per castle, and the diamond, cross and moon links the
+    disaster requires, either shared (3,) or per castle (N, 3)
+    """
+    links = np.asarray(links)
+    missing = np.maximum(np.asarray(requirements) - links[..., :3], 0)
+    return np.maximum(missing.sum(axis=-1) - links[..., 3], 0)
+
+
+class CastleBatch:
+    """
+    Struct-of-arrays view of many castles. Row i of every array is castle i
+    and column j is room j, as in a single Castle's data.
+    """
+
+    @staticmethod
+    def from_castles(castles: Sequence[Castle]):
+        if len(castles) == 0:
+            return CastleBatch(np.zeros((0, len(ROOM_CONNECTIONS), 4), int))
+        return CastleBatch(np.stack([castle._data for castle in castles]))
+
+    def __init__(self, data: np.array):
+        self.placed = data[:, :, 0] > 0
+        self.x = data[:, :, 1]
+        self.y = data[:, :, 2]
+        self.rotation = data[:, :, 3]
+
+    def __len__(self):
+        return len(self.placed)
+
+    def link_counts(self) -> np.array:
+        """
+        (diamond, cross, moon, wild) link counts of every castle, (N, 4)
+        """
+        castle_ids, room_ids = self.placed.nonzero()
+        xs = self.x[castle_ids, room_ids]
+        ys = self.y[castle_ids, room_ids]
+        sides = ROOM_CONNECTIONS[
+            room_ids, self.rotation[castle_ids, room_ids] // 90
+        ]
+
+        # A castle of n rooms fits in an n by n box around its throne room,
+        # so this key is unique per (castle, x, y)
+        offset = self.placed.shape[1]
+        width = 2 * offset + 1
+        keys = (castle_ids * width + xs + offset) * width + ys + offset
+        order = np.argsort(keys)
+        keys = keys[order]
+
+        kinds = []
+        owners = []
+        # Right neighbours are one column over, bottom neighbours one row
+        for step, side in ((width, 1), (1, 2)):
+            found = np.searchsorted(keys, keys + step)
+            found = np.minimum(found, len(keys) - 1)
+            has_adj = keys[found] == keys + step
+            a = order[has_adj]
+            b = order[found[has_adj]]
+            kinds.append(
+                LINK_KINDS[sides[a, side], sides[b, (side + 2) % 4]]
+            )
+            owners.append(castle_ids[a])
+        kinds = np.concatenate(kinds)
+        owners = np.concatenate(owners)
+        linked = kinds >= 0
+        counts = np.bincount(
+            owners[linked] * 4 + kinds[linked], minlength=len(self) * 4
+        )
+        return counts.reshape(len(self), 4)
+
+    def disaster_damage(self, requirements: np.array) -> np.array:
+        return disaster_damage(self.link_counts(), requirements)
+
@@ -0,0 +1,293 @@
+import time
+
+import numpy as np
+
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import disasters
+import manager
+from data.disaster_list import DISASTER_LIST
+from forecast import DisasterForecast
+from model import Castle, Game, ROTATIONS
+
+# Seconds a bot may think per action. BOT_TURN runs inside the Lambda's 10s
+# timeout (template.yml), which also has to cover loading and saving.
+DEFAULT_TIME_BUDGET = 2.0
+MAX_TIME_BUDGET = 6.0
+# Candidates kept after the greedy pass for Monte-Carlo evaluation
+CANDIDATE_LIMIT = 8
+# Room pairs tried as swaps, and rollouts sampled per batch
+SWAP_PAIR_LIMIT = 12
+ROLLOUT_BATCH = 256
+# Rollouts after which the estimate is good enough to stop early
+MAX_ROLLOUTS = 8192
+# Share of the time budget the greedy pass may use, so the rollouts always
+# get the rest, and rollout batches run even if the budget is spent
+SCORING_SHARE = 0.5
+MIN_ROLLOUT_BATCHES = 4
+
+
+def _links_after(castle: Castle, record: Dict) -> Optional[Tuple[int, ...]]:
+    """
+    Link counts the castle would have after the action, or None if the
+    action is illegal
+    """
+    try:
+        with castle.trial():
+            if record["action"] == "ACTION_SHOP":
+                castle.place(
+                    record["room_id"],
+                    record["x"],
+                    record["y"],
+                    record["rotation"],
+                )
+            elif record["action"] == "ACTION_MOVE":
+                castle.move(
+                    record["room_id"],
+                    record["x"],
+                    record["y"],
+                    record["rotation"],
+                )
+            elif record["action"] == "ACTION_SWAP":
+                castle.swap(
+                    record["room_id_a"],
+                    record["room_id_b"],
+                    record["rotation_a"],
+                    record["rotation_b"],
+                )
+            else:
+                castle.discard(*record["discard_list"])
+            return castle.num_connections()
+    except RuntimeError:
+        return None
+
+
+def candidate_actions(
+    game_info: Game, player_id: str, rng: np.random.Generator
+) -> List[Dict]:
+    """
+    Shop purchases, moves and swaps open to the player, as action records
+    """
+    castle = game_info.players[player_id].castle
+    candidates = []
+    for room_id in game_info.shop:
+        for x, y, rotation in castle.legal_placements(room_id):
+            candidates.append(
+                {
+                    "action": "ACTION_SHOP",
+                    "player_id": player_id,
+                    "room_id": room_id,
+                    "x": x,
+                    "y": y,
+                    "rotation": rotation,
+                }
+            )
+    for room_id in castle.discardable_rooms():
+        if room_id == castle.throne_room_id:
+            continue
+        with castle.trial():
+            castle.remove(room_id)
+            placements = castle.legal_placements(room_id)
+        for x, y, rotation in placements:
+            candidates.append(
+                {
+                    "action": "ACTION_MOVE",
+                    "player_id": player_id,
+                    "room_id": room_id,
+                    "x": x,
+                    "y": y,
+                    "rotation": rotation,
+                }
+            )
+    rooms = [
+        room_id
+        for room_id in castle.all_rooms().tolist()
+        if room_id != castle.throne_room_id
+    ]
+    if len(rooms) >= 2:
+        for _ in range(SWAP_PAIR_LIMIT):
+            pair = rng.choice(rooms, 2, replace=False).tolist()
+            room_id_a, room_id_b = pair
+            for rotation_a in ROTATIONS:
+                for rotation_b in ROTATIONS:
+                    candidates.append(
+                        {
+                            "action": "ACTION_SWAP",
+                            "player_id": player_id,
+                            "room_id_a": room_id_a,
+                            "room_id_b": room_id_b,
+                            "rotation_a": rotation_a,
+                            "rotation_b": rotation_b,
+                        }
+                    )
+    return candidates
+
+
+def _forecast(game_info: Game) -> DisasterForecast:
+    forecast = DisasterForecast(
+        game_info.num_disasters, game_info.num_catastrophes
+    )
+    for card in game_info.previous_disasters + game_info.current_disasters:
+        if card[0] == "c":
+            forecast.prev_catastrophes.append(DISASTER_LIST[card]["name"])
+        else:
+            forecast.prev_disasters.append(DISASTER_LIST[card]["name"])
+    return forecast
+
+
+def _disaster_pool(forecast: DisasterForecast) -> Tuple[np.array, np.array]:
+    """
+    Rows into the compiled disaster tables of the disasters that may still
+    be drawn, and the probability of each
+    """
+    dis, catas = forecast.disasters_prob()
+    dis_prob, possible_dis = dis
+    catas_prob, possible_catas = catas
+    rows = [disasters.DISASTER_INDEX[d.id] for d in possible_dis] + [
+        disasters.DISASTER_INDEX[c.id] for c in possible_catas
+    ]
+    weights = np.array(
+        [dis_prob] * len(possible_dis) + [catas_prob] * len(possible_catas)
+    )
+    if len(rows) == 0 or weights.sum() <= 0:
+        return np.zeros(0, dtype=int), np.zeros(0)
+    return np.array(rows), weights / weights.sum()
+
+
+def _draw_distribution(
+    forecast: DisasterForecast, deck: int
+) -> Tuple[np.array, np.array]:
+    """
+    Possible numbers of disasters drawn at the next restock and their
+    probabilities
+    """
+    try:
+        distribution = forecast.disaster_distribution(deck)
+    except (ValueError, ZeroDivisionError):
+        distribution = {1: 1.0}
+    counts = np.array(list(distribution), dtype=int)
+    probs = np.array([distribution[c] for c in distribution], dtype=float)
+    return counts, probs / probs.sum()
+
+
+def rollout_damage(
+    links: np.array,
+    num_previous: int,
+    pool: Tuple[np.array, np.array],
+    draws: Tuple[np.array, np.array],
+    num_rollouts: int,
+    seed: int,
+) -> np.array:
+    """
+    Total damage each candidate's castle takes over num_rollouts sampled
+    next restocks: how many disasters are drawn, which ones, and the
+    previous-disaster count each one hits at
+    """
+    rows, weights = pool
+    if len(rows) == 0:
+        return np.zeros(len(links))
+    rng = np.random.Generator(np.random.PCG64(seed))
+    counts, probs = draws
+    drawn = rng.choice(counts, num_rollouts, p=probs)
+    max_drawn = max(int(drawn.max()), 1)
+    table = disasters.damage_table(
+        links, np.arange(num_previous, num_previous + max_drawn)
+    )
+    picked = rng.choice(rows, (num_rollouts, max_drawn), p=weights)
+    # rollouts x draws x candidates
+    damage = table[picked, :, np.arange(max_drawn)[None, :]]
+    hit = np.arange(max_drawn)[None, :] < drawn[:, None]
+    return (damage * hit[:, :, None]).sum(axis=(0, 1))
+
+
+def _rollout_worker(args) -> np.array:
+    return rollout_damage(*args)
+
+
+def choose_action(
+    game_info: Game,
+    player_id: str,
+    time_budget: float = DEFAULT_TIME_BUDGET,
+    workers: int = 0,
+    seed: Optional[int] = None,
+) -> Optional[Dict]:
+    """
+    Action record for the player's next move, or None if it has nothing
+    to do or it is not its turn. Candidates are scored greedily on their
+    link counts, then the best are compared by Monte-Carlo rollouts of the
+    next disasters until the time budget runs out, spread over workers
+    processes if above 0.
+    """
+    start = time.perf_counter()
+    budget = min(time_budget, MAX_TIME_BUDGET)
+    deadline = start + budget
+    scoring_deadline = start + budget * SCORING_SHARE
+    rng = np.random.Generator(np.random.PCG64(seed))
+    castle = game_info.players[player_id].castle
+
+    if len(game_info.current_disasters) > 0:
+        options = manager.discard_options(game_info, player_id)
+        if len(options) == 0:
+            return None
+        return {
+            "action": "ACTION_DISCARD",
+            "player_id": player_id,
+            "discard_list": options[0],
+        }
+    if game_info.turn_order[game_info.turn_index] != player_id:
+        return None
+
+    scored = []
+    for record in candidate_actions(game_info, player_id, rng):
+        links = _links_after(castle, record)
+        if links is not None:
+            scored.append((sum(links), links, record))
+        if time.perf_counter() > scoring_deadline:
+            break
+    if len(scored) == 0:
+        return None
+    scored.sort(key=lambda entry: -entry[0])
+    scored = scored[:CANDIDATE_LIMIT]
+    links = np.array([entry[1] for entry in scored])
+
+    forecast = _forecast(game_info)
+    pool = _disaster_pool(forecast)
+    draws = _draw_distribution(forecast, len(game_info.deck))
+    num_previous = len(game_info.previous_disasters)
+    total = np.zeros(len(scored))
+    rollouts = 0
+    batches = 0
+
+    def more_rollouts() -> bool:
+        if batches < MIN_ROLLOUT_BATCHES:
+            return True
+        return time.perf_counter() < deadline and rollouts < MAX_ROLLOUTS
+
+    if workers > 0:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            while more_rollouts():
+                seeds = rng.integers(2 ** 32, size=workers).tolist()
+                jobs = [
+                    (links, num_previous, pool, draws, ROLLOUT_BATCH, s)
+                    for s in seeds
+                ]
+                for damage in executor.map(_rollout_worker, jobs):
+                    total += damage
+                rollouts += ROLLOUT_BATCH * workers
+                batches += 1
+    else:
+        while more_rollouts():
+            total += rollout_damage(
+                links,
+                num_previous,
+                pool,
+                draws,
+                ROLLOUT_BATCH,
+                int(rng.integers(2 ** 32)),
+            )
+            rollouts += ROLLOUT_BATCH
+            batches += 1
+    # Least expected damage first, most links on ties
+    best = min(range(len(scored)), key=lambda i: (total[i], -scored[i][0]))
+    return scored[best][2]
@@ -0,0 +1,68 @@
+from array import array
+from typing import Iterable, Union
+
+import numpy as np
+
+# Cards are coded as small integers: room cards by their room id, "dN"
+# disasters as DISASTER_CARD_START + N and "cN" catastrophes as
+# CATASTROPHE_CARD_START + N
+DISASTER_CARD_START = 1000
+CATASTROPHE_CARD_START = 2000
+# Unsigned 16-bit typed array holding coded cards
+CARD_TYPECODE = "H"
+
+
+def encode_card(card: Union[int, str]) -> int:
+    if isinstance(card, str):
+        if card[0] == "d":
+            return DISASTER_CARD_START + int(card[1:])
+        elif card[0] == "c":
+            return CATASTROPHE_CARD_START + int(card[1:])
+        raise RuntimeError("Unknown card {}".format(card))
+    return int(card)
+
+
+def decode_card(code: int) -> Union[int, str]:
+    if code >= CATASTROPHE_CARD_START:
+        return "c{}".format(code - CATASTROPHE_CARD_START)
+    elif code >= DISASTER_CARD_START:
+        return "d{}".format(code - DISASTER_CARD_START)
+    return code
+
+
+def is_disaster_card(code: int) -> bool:
+    """
+    True for disasters and catastrophes
+    """
+    return code >= DISASTER_CARD_START
+
+
+def card_array(cards: Iterable[Union[int, str]]) -> array:
+    return array(CARD_TYPECODE, [encode_card(card) for card in cards])
+
+
+def decode_cards(codes: array) -> list:
+    return [decode_card(code) for code in codes]
+
+
+def draw_random(codes: array, rng: np.random.Generator) -> int:
+    """
+    Removes and returns a uniformly random card in O(1) by swapping it
+    with the last card. Changes the order of the remaining cards.
+    """
+    index = int(rng.integers(len(codes)))
+    codes[index], codes[-1] = codes[-1], codes[index]
+    return codes.pop()
+
+
+def insert_random(
+    codes: array, new_codes: Iterable[int], rng: np.random.Generator
+):
+    """
+    Adds cards at uniformly random positions, keeping an already shuffled
+    pile shuffled. O(1) per card instead of reshuffling the whole pile.
+    """
+    for code in new_codes:
+        codes.append(code)
+        index = int(rng.integers(len(codes)))
+        codes[index], codes[-1] = codes[-1], codes[index]
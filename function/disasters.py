@@ -0,0 +1,106 @@
+import numpy as np
+
+from typing import List, Tuple
+
+from data.disaster_list import DISASTER_LIST
+
+LINKS = ("diamond", "cross", "moon")
+
+
+def _parse_formula(encoding: str) -> Tuple[int, int]:
+    """
+    (constant, per previous disaster) terms of a formula like "1+2x"
+    """
+    constant = 0
+    per_previous = 0
+    for term in encoding.split("+"):
+        if "x" in term:
+            per_previous += int(term.strip("x") or 1)
+        else:
+            constant += int(term)
+    return constant, per_previous
+
+
+def _compile_disasters() -> Tuple[List[str], np.array, np.array]:
+    ids = list(DISASTER_LIST)
+    constant = np.zeros((len(ids), len(LINKS)), dtype=int)
+    per_previous = np.zeros((len(ids), len(LINKS)), dtype=int)
+    for row, disaster_id in enumerate(ids):
+        for col, link in enumerate(LINKS):
+            constant[row, col], per_previous[row, col] = _parse_formula(
+                DISASTER_LIST[disaster_id][link]
+            )
+    return ids, constant, per_previous
+
+
+# Compiled once at import: row i of both tables is DISASTER_IDS[i] and the
+# columns are the diamond, cross and moon links it requires
+DISASTER_IDS, DAMAGE_CONSTANT, DAMAGE_PER_PREVIOUS = _compile_disasters()
+DISASTER_INDEX = {
+    disaster_id: row for row, disaster_id in enumerate(DISASTER_IDS)
+}
+
+
+def requirements(disaster_id: str, num_previous: int) -> Tuple[int, int, int]:
+    """
+    Diamond, cross and moon links needed to avoid the disaster's damage
+    """
+    row = DISASTER_INDEX[disaster_id]
+    required = DAMAGE_CONSTANT[row] + DAMAGE_PER_PREVIOUS[row] * num_previous
+    return tuple(required.tolist())
+
+
+def damage_table(links: np.array, num_previous: np.array) -> np.array:
+    """
+    Damage of every disaster to every castle for every previous disaster
+    count, shaped (disasters, castles, counts), from (castles, 4) diamond,
+    cross, moon and wild link counts
+    """
+    links = np.asarray(links)[None, :, None, :]
+    num_previous = np.asarray(num_previous)[None, None, :, None]
+    required = (
+        DAMAGE_CONSTANT[:, None, None, :]
+        + DAMAGE_PER_PREVIOUS[:, None, None, :] * num_previous
+    )
+    missing = np.maximum(required - links[..., :3], 0).sum(axis=-1)
+    return np.maximum(missing - links[..., 3], 0)
+
+
+class Disaster:
+    def __init__(self, disaster_id: str):
+        row = DISASTER_INDEX[disaster_id]
+        self.id = disaster_id
+        self.name = DISASTER_LIST[disaster_id]["name"]
+        self.constant = DAMAGE_CONSTANT[row]
+        self.per_previous = DAMAGE_PER_PREVIOUS[row]
+
+    def is_catastrophe(self) -> bool:
+        return self.id[0] == "c"
+
+    def damage(
+        self,
+        num_previous: int,
+        links: Tuple[int, int, int],
+        reduction: int = 0,
+        multiplier: float = 1,
+    ) -> Tuple[int, int, int, int]:
+        """
+        Diamond, cross and moon damage after the castle's links, and their
+        total after reduction, all scaled by multiplier
+        """
+        required = self.constant + self.per_previous * num_previous
+        missing = np.maximum(required - np.asarray(links), 0) * multiplier
+        diamond, cross, moon = missing.tolist()
+        total = max(diamond + cross + moon - reduction * multiplier, 0)
+        return diamond, cross, moon, total
+
+
+_ALL = [Disaster(disaster_id) for disaster_id in DISASTER_IDS]
+
+
+def all_disasters() -> List[Disaster]:
+    return [d for d in _ALL if not d.is_catastrophe()]
+
+
+def all_catastrophes() -> List[Disaster]:
+    return [d for d in _ALL if d.is_catastrophe()]
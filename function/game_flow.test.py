@@ -0,0 +1,152 @@
+import os
+import unittest
+
+# Games are kept in the process, so the whole flow runs without AWS
+os.environ["GAME_STORE"] = "memory"
+
+import actions  # noqa: E402
+import lambda_function  # noqa: E402
+
+# Shop actions played before the replay is checked
+NUM_ACTIONS = 12
+
+
+def handler(event):
+    return lambda_function.lambda_handler(event, {"requestid": "1234"})
+
+
+class TestGameFlow(unittest.TestCase):
+    def setUp(self):
+        lambda_function._store = None
+        lambda_function._join_codes.clear()
+        created = handler({"action": "CREATE_LOBBY", "username": "a"})
+        code = created["join_code"]
+        joined = handler(
+            {
+                "action": "JOIN_LOBBY",
+                "username": "b",
+                "join_code": code[:3].lower() + "-" + code[3:],
+            }
+        )
+        self.assertEqual(joined["game_id"], created["game_id"])
+        self.game = {
+            "game_id": created["game_id"],
+            "game_timestamp": created["game_timestamp"],
+        }
+        self.players = [created["player_id"], joined["player_id"]]
+        for i, player_id in enumerate(self.players):
+            ready = handler(
+                dict(
+                    self.game,
+                    action="READY_LOBBY",
+                    player_id=player_id,
+                    throne_room_id=101 + i,
+                )
+            )
+            self.assertNotIn("error", ready)
+        started = handler(
+            dict(self.game, action="START_GAME", player_id=self.players[0])
+        )
+        self.assertNotIn("error", started)
+
+    def info(self, player_id=None):
+        event = dict(self.game, action="GET_GAME_INFO")
+        if player_id is not None:
+            event["player_id"] = player_id
+        return handler(event)
+
+    def play(self) -> bool:
+        """
+        Discards for a pending disaster, or makes the first shop purchase
+        open to the player whose turn it is. False if no one could act.
+        """
+        for player_id in self.players:
+            info = self.info(player_id)
+            if len(info["game_info"]["current_disasters"]) > 0:
+                if len(info["discard_options"]) == 0:
+                    continue
+                event = dict(
+                    self.game,
+                    action="ACTION_DISCARD",
+                    discard_list=info["discard_options"][0],
+                )
+            else:
+                placements = [
+                    (int(room_id), placement)
+                    for room_id, room_placements in info[
+                        "shop_placements"
+                    ].items()
+                    for placement in room_placements
+                ]
+                if len(placements) == 0:
+                    continue
+                room_id, (x, y, rotation) = placements[0]
+                event = dict(
+                    self.game,
+                    action="ACTION_SHOP",
+                    room_id=room_id,
+                    x=x,
+                    y=y,
+                    rotation=rotation,
+                )
+            result = handler(dict(event, player_id=player_id))
+            if "error" not in result:
+                return True
+            self.assertEqual(result["error"], actions.REJECTED)
+        return False
+
+    def test_actions_are_logged_and_replayed(self):
+        start = self.info()
+        self.assertEqual(start["action_seq"], 0)
+        played = 0
+        while played < NUM_ACTIONS and self.play():
+            played += 1
+        self.assertGreater(played, 0)
+
+        final = self.info()
+        self.assertEqual(final["action_seq"], played)
+        for seq, expected in ((0, start), (played, final)):
+            replay = handler(
+                dict(self.game, action="GET_GAME_REPLAY", action_seq=seq)
+            )
+            self.assertEqual(replay["game_info"], expected["game_info"])
+
+    def test_rejected_actions_are_not_logged(self):
+        info = self.info(self.players[0])
+        room_id = int(next(iter(info["shop_placements"])))
+        for player_id in self.players:
+            result = handler(
+                dict(
+                    self.game,
+                    action="ACTION_SHOP",
+                    player_id=player_id,
+                    room_id=room_id,
+                    x=50,
+                    y=50,
+                    rotation=0,
+                )
+            )
+            self.assertEqual(result["error"], actions.REJECTED)
+        result = handler(
+            dict(
+                self.game,
+                action="ACTION_MOVE",
+                player_id=self.players[0],
+                room_id=999,
+                x=0,
+                y=1,
+                rotation=0,
+            )
+        )
+        self.assertEqual(result["error"], actions.INVALID_FIELD)
+        self.assertEqual(self.info()["action_seq"], 0)
+
+    def test_unknown_join_code(self):
+        result = handler(
+            {"action": "JOIN_LOBBY", "username": "c", "join_code": "AAAAAA"}
+        )
+        self.assertEqual(result["error"], actions.NOT_FOUND)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,540 @@
+import json
+import threading
+import time
+
+from abc import ABC, abstractmethod
+from collections import deque
+from contextlib import contextmanager
+from decimal import Decimal
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import boto3
+from boto3.dynamodb.conditions import Key
+
+import item_diff
+from item_diff import Path
+
+# Latest latencies kept per operation for percentiles
+METRIC_SAMPLES = 1000
+
+
+class ConflictError(Exception):
+    """
+    A conditional write found the item not as expected
+    """
+
+
+# Expected value of an attribute that must not exist
+ABSENT = object()
+
+
+class OperationStats:
+    def __init__(self):
+        self.count = 0
+        self.conflicts = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.samples: deque = deque(maxlen=METRIC_SAMPLES)
+
+    def add(self, ms: float, conflict: bool):
+        self.count += 1
+        self.conflicts += conflict
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+        self.samples.append(ms)
+
+    def summary(self) -> Dict[str, float]:
+        samples = sorted(self.samples)
+        return {
+            "count": self.count,
+            "conflicts": self.conflicts,
+            "mean_ms": round(self.total_ms / self.count, 3),
+            "p50_ms": round(_percentile(samples, 0.5), 3),
+            "p99_ms": round(_percentile(samples, 0.99), 3),
+            "max_ms": round(self.max_ms, 3),
+        }
+
+
+def _percentile(samples: List[float], q: float) -> float:
+    return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+
+class GameStore(ABC):
+    """
+    Items of the game table, keyed by id and timestamp, with the
+    conditional writes the function relies on. Every operation is timed.
+    """
+
+    def __init__(self):
+        self._stats_lock = threading.Lock()
+        self._stats: Dict[str, OperationStats] = {}
+
+    def get(self, item_id: str, timestamp: int) -> Optional[Dict]:
+        return self._call("get", self._get, item_id, timestamp)
+
+    def put(self, item: Dict, if_absent: bool = False):
+        """
+        Stores item, replacing the item with its key unless if_absent, in
+        which case it raises ConflictError if the key is taken
+        """
+        self._call("put", self._put, item, if_absent)
+
+    def update(
+        self,
+        item_id: str,
+        timestamp: int,
+        sets: Sequence[Tuple[Path, object]],
+        removes: Sequence[Path] = (),
+        add: Optional[Dict[str, int]] = None,
+        expected: Optional[Dict[str, object]] = None,
+        below: Optional[Dict[str, int]] = None,
+    ):
+        """
+        Sets and removes attribute paths and adds to top-level numbers,
+        creating the item if needed. Raises ConflictError unless each
+        expected attribute has its value, or is missing if it is ABSENT,
+        and each below attribute is missing or less than its value.
+        """
+        self._call(
+            "update",
+            self._update,
+            item_id,
+            timestamp,
+            sets,
+            removes,
+            add or {},
+            expected or {},
+            below or {},
+        )
+
+    def query(
+        self,
+        item_id: str,
+        after: Optional[int] = None,
+        up_to: Optional[int] = None,
+        newest_first: bool = False,
+        limit: Optional[int] = None,
+    ) -> List[Dict]:
+        """
+        Items with item_id whose timestamp is above after and at most
+        up_to, oldest first unless newest_first
+        """
+        return self._call(
+            "query", self._query, item_id, after, up_to, newest_first, limit
+        )
+
+    def metrics(self) -> Dict[str, Dict[str, float]]:
+        """
+        Count, conflicts and latency of each operation so far
+        """
+        with self._stats_lock:
+            return {
+                operation: stats.summary()
+                for operation, stats in sorted(self._stats.items())
+            }
+
+    def reset_metrics(self):
+        with self._stats_lock:
+            self._stats = {}
+
+    def _call(self, operation: str, fn: Callable, *args):
+        start = time.perf_counter()
+        conflict = False
+        try:
+            return fn(*args)
+        except ConflictError:
+            conflict = True
+            raise
+        finally:
+            ms = 1000 * (time.perf_counter() - start)
+            with self._stats_lock:
+                if operation not in self._stats:
+                    self._stats[operation] = OperationStats()
+                self._stats[operation].add(ms, conflict)
+
+    @abstractmethod
+    def _get(self, item_id: str, timestamp: int) -> Optional[Dict]:
+        ...
+
+    @abstractmethod
+    def _put(self, item: Dict, if_absent: bool):
+        ...
+
+    @abstractmethod
+    def _update(
+        self,
+        item_id: str,
+        timestamp: int,
+        sets: Sequence[Tuple[Path, object]],
+        removes: Sequence[Path],
+        add: Dict[str, int],
+        expected: Dict[str, object],
+        below: Dict[str, int],
+    ):
+        ...
+
+    @abstractmethod
+    def _query(
+        self,
+        item_id: str,
+        after: Optional[int],
+        up_to: Optional[int],
+        newest_first: bool,
+        limit: Optional[int],
+    ) -> List[Dict]:
+        ...
+
+
+class DynamoDBStore(GameStore):
+    def __init__(
+        self,
+        table_name: str,
+        endpoint_url: Optional[str] = None,
+        trace: bool = False,
+    ):
+        super().__init__()
+        if trace:
+            from aws_xray_sdk.core import patch
+
+            patch(("botocore",))
+        # Instantiate a table resource object without actually
+        # creating a DynamoDB table. Its attributes are lazy-loaded: no
+        # request is made until they are accessed or load() is called.
+        dynamodb = boto3.resource("dynamodb", endpoint_url=endpoint_url)
+        self.table = dynamodb.Table(table_name)
+        self._conflict = (
+            self.table.meta.client.exceptions.ConditionalCheckFailedException
+        )
+
+    def _get(self, item_id: str, timestamp: int) -> Optional[Dict]:
+        response = self.table.get_item(
+            Key={"id": item_id, "timestamp": timestamp}
+        )
+        return response.get("Item")
+
+    def _put(self, item: Dict, if_absent: bool):
+        kwargs = {"Item": item}
+        if if_absent:
+            kwargs["ConditionExpression"] = "attribute_not_exists(id)"
+        try:
+            self.table.put_item(**kwargs)
+        except self._conflict:
+            raise ConflictError()
+
+    def _update(
+        self,
+        item_id: str,
+        timestamp: int,
+        sets: Sequence[Tuple[Path, object]],
+        removes: Sequence[Path],
+        add: Dict[str, int],
+        expected: Dict[str, object],
+        below: Dict[str, int],
+    ):
+        expression, names, values = item_diff.update_expression(
+            list(sets), list(removes)
+        )
+        clauses = [expression] if expression else []
+        increments = []
+        for n, (name, amount) in enumerate(add.items()):
+            names["#a{}".format(n)] = name
+            values[":a{}".format(n)] = amount
+            increments.append("#a{0} :a{0}".format(n))
+        if increments:
+            clauses.append("ADD " + ", ".join(increments))
+        conditions = []
+        for n, (name, value) in enumerate(expected.items()):
+            names["#c{}".format(n)] = name
+            if value is ABSENT:
+                conditions.append("attribute_not_exists(#c{})".format(n))
+            else:
+                values[":c{}".format(n)] = value
+                conditions.append("#c{0} = :c{0}".format(n))
+        for n, (name, value) in enumerate(below.items()):
+            names["#b{}".format(n)] = name
+            values[":b{}".format(n)] = value
+            conditions.append(
+                "(attribute_not_exists(#b{0}) OR #b{0} < :b{0})".format(n)
+            )
+        kwargs = {
+            "Key": {"id": item_id, "timestamp": timestamp},
+            "UpdateExpression": " ".join(clauses),
+            "ExpressionAttributeNames": names,
+        }
+        if values:
+            kwargs["ExpressionAttributeValues"] = values
+        if conditions:
+            kwargs["ConditionExpression"] = " AND ".join(conditions)
+        try:
+            self.table.update_item(**kwargs)
+        except self._conflict:
+            raise ConflictError()
+
+    def _query(
+        self,
+        item_id: str,
+        after: Optional[int],
+        up_to: Optional[int],
+        newest_first: bool,
+        limit: Optional[int],
+    ) -> List[Dict]:
+        condition = Key("id").eq(item_id)
+        if after is not None and up_to is not None:
+            condition &= Key("timestamp").between(after + 1, up_to)
+        elif after is not None:
+            condition &= Key("timestamp").gt(after)
+        elif up_to is not None:
+            condition &= Key("timestamp").lte(up_to)
+        query = {
+            "KeyConditionExpression": condition,
+            "ScanIndexForward": not newest_first,
+        }
+        if limit is not None:
+            query["Limit"] = limit
+        items: List[Dict] = []
+        while True:
+            response = self.table.query(**query)
+            items.extend(response["Items"])
+            if "LastEvaluatedKey" not in response or (
+                limit is not None and len(items) >= limit
+            ):
+                return items[:limit]
+            query["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+
+def _encode(item: Dict) -> str:
+    return json.dumps(item, separators=(",", ":"), default=_encode_number)
+
+
+def _encode_number(value):
+    if isinstance(value, Decimal):
+        if value == value.to_integral_value():
+            return int(value)
+        return float(value)
+    raise TypeError("Unsupported type {}".format(type(value).__name__))
+
+
+def _decode(data: str) -> Dict:
+    # Numbers come back as Decimals, like boto3 returns them
+    return json.loads(data, parse_float=Decimal, parse_int=Decimal)
+
+
+class LocalStore(GameStore):
+    """
+    Store kept by this process. Items are kept as JSON and each operation
+    runs in a transaction, so writes are atomic like DynamoDB requests.
+    """
+
+    @abstractmethod
+    def _transaction(self):
+        ...
+
+    @abstractmethod
+    def _read(self, item_id: str, timestamp: int) -> Optional[str]:
+        ...
+
+    @abstractmethod
+    def _write(self, item_id: str, timestamp: int, data: str):
+        ...
+
+    @abstractmethod
+    def _range(
+        self,
+        item_id: str,
+        after: Optional[int],
+        up_to: Optional[int],
+        newest_first: bool,
+        limit: Optional[int],
+    ) -> List[str]:
+        ...
+
+    def _get(self, item_id: str, timestamp: int) -> Optional[Dict]:
+        with self._transaction():
+            data = self._read(item_id, int(timestamp))
+        return None if data is None else _decode(data)
+
+    def _put(self, item: Dict, if_absent: bool):
+        item_id, timestamp = item["id"], int(item["timestamp"])
+        data = _encode(item)
+        with self._transaction():
+            if if_absent and self._read(item_id, timestamp) is not None:
+                raise ConflictError()
+            self._write(item_id, timestamp, data)
+
+    def _update(
+        self,
+        item_id: str,
+        timestamp: int,
+        sets: Sequence[Tuple[Path, object]],
+        removes: Sequence[Path],
+        add: Dict[str, int],
+        expected: Dict[str, object],
+        below: Dict[str, int],
+    ):
+        timestamp = int(timestamp)
+        with self._transaction():
+            data = self._read(item_id, timestamp)
+            if data is None:
+                item = {"id": item_id, "timestamp": timestamp}
+            else:
+                item = _decode(data)
+            for name, value in expected.items():
+                if value is ABSENT:
+                    if name in item:
+                        raise ConflictError()
+                elif name not in item or item[name] != value:
+                    raise ConflictError()
+            for name, value in below.items():
+                if name in item and not item[name] < value:
+                    raise ConflictError()
+            for path, value in sets:
+                _parent(item, path)[path[-1]] = value
+            for path in removes:
+                _parent(item, path).pop(path[-1], None)
+            for name, amount in add.items():
+                item[name] = item.get(name, 0) + amount
+            self._write(item_id, timestamp, _encode(item))
+
+    def _query(
+        self,
+        item_id: str,
+        after: Optional[int],
+        up_to: Optional[int],
+        newest_first: bool,
+        limit: Optional[int],
+    ) -> List[Dict]:
+        with self._transaction():
+            found = self._range(item_id, after, up_to, newest_first, limit)
+        return [_decode(data) for data in found]
+
+
+def _parent(item: Dict, path: Path) -> Dict:
+    for key in path[:-1]:
+        item = item[key]
+    return item
+
+
+class MemoryStore(LocalStore):
+    """
+    Items in a dict, gone when the process exits
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._lock = threading.Lock()
+        self._items: Dict[str, Dict[int, str]] = {}
+
+    def _transaction(self):
+        return self._lock
+
+    def _read(self, item_id: str, timestamp: int) -> Optional[str]:
+        return self._items.get(item_id, {}).get(timestamp)
+
+    def _write(self, item_id: str, timestamp: int, data: str):
+        self._items.setdefault(item_id, {})[timestamp] = data
+
+    def _range(
+        self,
+        item_id: str,
+        after: Optional[int],
+        up_to: Optional[int],
+        newest_first: bool,
+        limit: Optional[int],
+    ) -> List[str]:
+        items = self._items.get(item_id, {})
+        timestamps = sorted(
+            timestamp
+            for timestamp in items
+            if (after is None or timestamp > after)
+            and (up_to is None or timestamp <= up_to)
+        )
+        if newest_first:
+            timestamps.reverse()
+        return [items[timestamp] for timestamp in timestamps[:limit]]
+
+
+class SQLiteStore(LocalStore):
+    """
+    Items in a SQLite database file, which several processes can share
+    """
+
+    def __init__(self, path: str):
+        import sqlite3
+
+        super().__init__()
+        self._lock = threading.Lock()
+        # Transactions are begun explicitly, and the lock keeps threads
+        # from interleaving them on the shared connection
+        self._connection = sqlite3.connect(
+            path, timeout=30, isolation_level=None, check_same_thread=False
+        )
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS items ("
+            "id TEXT NOT NULL, timestamp INTEGER NOT NULL, "
+            "item TEXT NOT NULL, PRIMARY KEY (id, timestamp))"
+        )
+
+    @contextmanager
+    def _transaction(self) -> Iterator[None]:
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                yield
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                raise
+            self._connection.execute("COMMIT")
+
+    def _read(self, item_id: str, timestamp: int) -> Optional[str]:
+        row = self._connection.execute(
+            "SELECT item FROM items WHERE id = ? AND timestamp = ?",
+            (item_id, timestamp),
+        ).fetchone()
+        return None if row is None else row[0]
+
+    def _write(self, item_id: str, timestamp: int, data: str):
+        self._connection.execute(
+            "INSERT OR REPLACE INTO items (id, timestamp, item) "
+            "VALUES (?, ?, ?)",
+            (item_id, timestamp, data),
+        )
+
+    def _range(
+        self,
+        item_id: str,
+        after: Optional[int],
+        up_to: Optional[int],
+        newest_first: bool,
+        limit: Optional[int],
+    ) -> List[str]:
+        sql = "SELECT item FROM items WHERE id = ?"
+        params: List[object] = [item_id]
+        if after is not None:
+            sql += " AND timestamp > ?"
+            params.append(int(after))
+        if up_to is not None:
+            sql += " AND timestamp <= ?"
+            params.append(int(up_to))
+        sql += " ORDER BY timestamp" + (" DESC" if newest_first else "")
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        return [row[0] for row in self._connection.execute(sql, params)]
+
+
+def open_store(
+    spec: str,
+    table_name: str,
+    endpoint_url: Optional[str] = None,
+    trace: bool = False,
+) -> GameStore:
+    """
+    Store named by spec: "dynamodb", "memory" or "sqlite:<path>"
+    """
+    if spec == "dynamodb":
+        return DynamoDBStore(table_name, endpoint_url, trace)
+    if spec == "memory":
+        return MemoryStore()
+    if spec.startswith("sqlite:"):
+        return SQLiteStore(spec[len("sqlite:") :])
+    raise RuntimeError("Unknown game store {}".format(spec))
@@ -0,0 +1,123 @@
+import os
+import tempfile
+import unittest
+
+from decimal import Decimal
+
+import game_store
+from game_store import ABSENT, ConflictError
+
+
+class StoreTests:
+    """
+    Condition semantics every local store must share with DynamoDB
+    """
+
+    def make_store(self) -> game_store.GameStore:
+        raise NotImplementedError
+
+    def setUp(self):
+        self.store = self.make_store()
+
+    def test_put_if_absent(self):
+        self.store.put({"id": "g", "timestamp": 1, "a": 1}, if_absent=True)
+        with self.assertRaises(ConflictError):
+            self.store.put({"id": "g", "timestamp": 1}, if_absent=True)
+        self.store.put({"id": "g", "timestamp": 1, "a": 2})
+        self.assertEqual(self.store.get("g", 1)["a"], 2)
+
+    def test_numbers_read_back_as_decimal(self):
+        self.store.put({"id": "g", "timestamp": 1, "a": {"b": [3]}})
+        item = self.store.get("g", 1)
+        self.assertIsInstance(item["a"]["b"][0], Decimal)
+        self.assertIsNone(self.store.get("g", 2))
+
+    def test_update_creates_item_and_adds(self):
+        self.store.update("g", 1, [(("a",), {"b": 1})], add={"version": 1})
+        self.store.update(
+            "g",
+            1,
+            [(("a", "c"), 2)],
+            removes=[("a", "b")],
+            add={"version": 1},
+        )
+        item = self.store.get("g", 1)
+        self.assertEqual(item["a"], {"c": 2})
+        self.assertEqual(item["version"], 2)
+
+    def test_expected(self):
+        self.store.put({"id": "g", "timestamp": 1, "version": 1})
+        with self.assertRaises(ConflictError):
+            self.store.update("g", 1, [(("a",), 1)], expected={"version": 2})
+        with self.assertRaises(ConflictError):
+            self.store.update("g", 1, [(("a",), 1)], expected={"other": 1})
+        self.store.update("g", 1, [(("a",), 1)], expected={"version": 1})
+        self.assertEqual(self.store.get("g", 1)["a"], 1)
+
+    def test_expected_absent(self):
+        self.store.update("g", 1, [(("a",), 1)], expected={"a": ABSENT})
+        with self.assertRaises(ConflictError):
+            self.store.update("g", 1, [(("a",), 2)], expected={"a": ABSENT})
+        self.assertEqual(self.store.get("g", 1)["a"], 1)
+
+    def test_below(self):
+        self.store.update("g", 1, [(("seq",), 1)], below={"seq": 1})
+        self.store.update("g", 1, [(("seq",), 2)], below={"seq": 2})
+        with self.assertRaises(ConflictError):
+            self.store.update("g", 1, [(("seq",), 2)], below={"seq": 2})
+        self.assertEqual(self.store.get("g", 1)["seq"], 2)
+
+    def test_failed_update_changes_nothing(self):
+        self.store.put({"id": "g", "timestamp": 1, "version": 1})
+        with self.assertRaises(ConflictError):
+            self.store.update(
+                "g", 1, [(("a",), 1)], add={"version": 1}, below={"version": 1}
+            )
+        self.assertEqual(
+            self.store.get("g", 1), {"id": "g", "timestamp": 1, "version": 1}
+        )
+
+    def test_query_range(self):
+        for seq in range(1, 6):
+            self.store.put({"id": "g#log", "timestamp": seq})
+        self.store.put({"id": "other", "timestamp": 3})
+
+        def timestamps(**kwargs):
+            return [
+                int(item["timestamp"])
+                for item in self.store.query("g#log", **kwargs)
+            ]
+
+        self.assertEqual(timestamps(), [1, 2, 3, 4, 5])
+        self.assertEqual(timestamps(after=2), [3, 4, 5])
+        self.assertEqual(timestamps(after=1, up_to=3), [2, 3])
+        self.assertEqual(
+            timestamps(up_to=4, newest_first=True, limit=2), [4, 3]
+        )
+        self.assertEqual(timestamps(after=5), [])
+
+    def test_metrics_count_conflicts(self):
+        self.store.put({"id": "g", "timestamp": 1}, if_absent=True)
+        with self.assertRaises(ConflictError):
+            self.store.put({"id": "g", "timestamp": 1}, if_absent=True)
+        put = self.store.metrics()["put"]
+        self.assertEqual((put["count"], put["conflicts"]), (2, 1))
+        self.store.reset_metrics()
+        self.assertEqual(self.store.metrics(), {})
+
+
+class TestMemoryStore(StoreTests, unittest.TestCase):
+    def make_store(self):
+        return game_store.open_store("memory", "disastle_game")
+
+
+class TestSQLiteStore(StoreTests, unittest.TestCase):
+    def make_store(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, "games.sqlite3")
+        return game_store.open_store("sqlite:" + path, "disastle_game")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,80 @@
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Path of an attribute inside an item, as map keys from the top level
+Path = Tuple[str, ...]
+
+# DynamoDB rejects expressions longer than 4KB
+MAX_EXPRESSION_LENGTH = 4096
+
+
+def diff(
+    old: Dict, new: Dict, keys: Optional[Iterable[str]] = None
+) -> Tuple[List[Tuple[Path, object]], List[Path]]:
+    """
+    Attribute paths to set, with their new values, and paths to remove to
+    turn old into new. Maps present on both sides are compared key by key;
+    anything else that differs is replaced whole. Only keys are compared if
+    given.
+    """
+    sets: List[Tuple[Path, object]] = []
+    removes: List[Path] = []
+
+    def visit(path: Path, old_map: Dict, new_map: Dict, keys):
+        for key in keys:
+            if key not in new_map:
+                if key in old_map:
+                    removes.append(path + (key,))
+            elif key not in old_map:
+                sets.append((path + (key,), new_map[key]))
+            elif isinstance(old_map[key], dict) and isinstance(
+                new_map[key], dict
+            ):
+                visit(
+                    path + (key,),
+                    old_map[key],
+                    new_map[key],
+                    set(old_map[key]) | set(new_map[key]),
+                )
+            elif old_map[key] != new_map[key]:
+                sets.append((path + (key,), new_map[key]))
+
+    visit((), old, new, keys if keys is not None else set(old) | set(new))
+    return sets, removes
+
+
+def update_expression(
+    sets: List[Tuple[Path, object]], removes: List[Path]
+) -> Tuple[str, Dict[str, str], Dict[str, object]]:
+    """
+    UpdateExpression with its attribute names and values. Every path
+    segment goes through a name placeholder, since map keys such as player
+    ids are not valid in a bare path.
+    """
+    names: Dict[str, str] = {}
+    placeholders: Dict[str, str] = {}
+    values: Dict[str, object] = {}
+
+    def path_expression(path: Path) -> str:
+        parts = []
+        for key in path:
+            if key not in placeholders:
+                placeholders[key] = "#p{}".format(len(placeholders))
+                names[placeholders[key]] = key
+            parts.append(placeholders[key])
+        return ".".join(parts)
+
+    clauses = []
+    if sets:
+        assignments = []
+        for path, value in sets:
+            placeholder = ":v{}".format(len(values))
+            values[placeholder] = value
+            assignments.append(
+                "{} = {}".format(path_expression(path), placeholder)
+            )
+        clauses.append("SET " + ", ".join(assignments))
+    if removes:
+        clauses.append(
+            "REMOVE " + ", ".join(path_expression(path) for path in removes)
+        )
+    return " ".join(clauses), names, values
@@ -0,0 +1,69 @@
+import unittest
+
+import item_diff
+
+
+class TestDiff(unittest.TestCase):
+    def test_nested_maps_are_compared_key_by_key(self):
+        old = {"players": {"p1": {"castle": {"1": [0, 1, 0]}, "ready": 1}}}
+        new = {"players": {"p1": {"castle": {"1": [0, 1, 90]}, "ready": 1}}}
+        sets, removes = item_diff.diff(old, new)
+        self.assertEqual(
+            sets, [(("players", "p1", "castle", "1"), [0, 1, 90])]
+        )
+        self.assertEqual(removes, [])
+
+    def test_added_and_removed_keys(self):
+        old = {"shop": [1, 2], "players": {"p1": {"discard_list": [3]}}}
+        new = {"players": {"p1": {}, "p2": {"username": "b"}}}
+        sets, removes = item_diff.diff(old, new)
+        self.assertEqual(sets, [(("players", "p2"), {"username": "b"})])
+        self.assertCountEqual(
+            removes, [("shop",), ("players", "p1", "discard_list")]
+        )
+
+    def test_map_replaced_by_other_value_is_set_whole(self):
+        sets, removes = item_diff.diff({"a": {"b": 1}}, {"a": [1]})
+        self.assertEqual(sets, [(("a",), [1])])
+        self.assertEqual(removes, [])
+
+    def test_only_given_keys_are_compared(self):
+        sets, removes = item_diff.diff(
+            {"a": 1, "b": 1}, {"a": 2, "b": 2}, keys=["a"]
+        )
+        self.assertEqual(sets, [(("a",), 2)])
+        self.assertEqual(removes, [])
+
+    def test_equal_items(self):
+        item = {"a": {"b": [1, 2]}, "c": "d"}
+        self.assertEqual(item_diff.diff(item, dict(item)), ([], []))
+
+
+class TestUpdateExpression(unittest.TestCase):
+    def test_path_segments_share_name_placeholders(self):
+        expression, names, values = item_diff.update_expression(
+            [(("players", "p1", "ready"), 1), (("players", "p2"), {})],
+            [("players", "p1", "discard_list")],
+        )
+        self.assertEqual(
+            expression,
+            "SET #p0.#p1.#p2 = :v0, #p0.#p3 = :v1 REMOVE #p0.#p1.#p4",
+        )
+        self.assertEqual(
+            names,
+            {
+                "#p0": "players",
+                "#p1": "p1",
+                "#p2": "ready",
+                "#p3": "p2",
+                "#p4": "discard_list",
+            },
+        )
+        self.assertEqual(values, {":v0": 1, ":v1": {}})
+
+    def test_nothing_to_update(self):
+        self.assertEqual(item_diff.update_expression([], []), ("", {}, {}))
+
+
+if __name__ == "__main__":
+    unittest.main()
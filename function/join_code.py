@@ -0,0 +1,32 @@
+import random
+
+from typing import Optional
+
+# Letters and digits that are hard to mix up when read out, so no 0/O or
+# 1/I/L. Six of them give about 900 million codes.
+ALPHABET = "ABCDEFGHJKMNPQRSTUVWXYZ23456789"
+LENGTH = 6
+
+_random = random.SystemRandom()
+
+
+def generate() -> str:
+    return "".join(_random.choice(ALPHABET) for _ in range(LENGTH))
+
+
+def normalize(code: str) -> Optional[str]:
+    """
+    The code as generated, ignoring case, spaces and dashes, or None if it
+    cannot be one
+    """
+    code = code.upper().replace("-", "").replace(" ", "")
+    if len(code) != LENGTH or any(c not in ALPHABET for c in code):
+        return None
+    return code
+
+
+def item_id(code: str) -> str:
+    """
+    Partition key of the item mapping a join code to its lobby
+    """
+    return "join#" + code
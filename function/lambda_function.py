@@ -1,373 +1,501 @@
+import copy
 import os
 import logging
+import random
+import time
 import uuid
 
 from datetime import datetime
-from typing import Dict
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Tuple
 
-import jsonpickle
-import boto3
-from boto3.dynamodb.conditions import Key
+import actions
+import game_store
+import item_diff
+import join_code
+import request_log
+from actions import action
 
-# from aws_xray_sdk.core import xray_recorder
-from aws_xray_sdk.core import patch_all
-
-import manager
-from model import Game
+# The game engine (action_log, bot, manager, model) is imported inside the
+# functions that use it, so lobby requests never load NumPy
+if TYPE_CHECKING:
+    from model import Game
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
-patch_all()
-
-client = boto3.client("lambda")
-client.get_account_settings()
 
-# Get the service resource.
-dynamodb = boto3.resource("dynamodb")
-
-# Instantiate a table resource object without actually
-# creating a DynamoDB table. Note that the attributes of this table
-# are lazy-loaded: a request is not made nor are the attribute
-# values populated until the attributes
-# on the table resource are accessed or its load() method is called.
-game_table = dynamodb.Table("disastle_game")
+GAME_TABLE_NAME = "disastle_game"
+# Where games are kept: "dynamodb", or "memory" or "sqlite:<path>" to run
+# the function offline
+GAME_STORE = os.environ.get("GAME_STORE", "dynamodb")
+# Points the table at a local DynamoDB, like DynamoDB Local, if set
+DYNAMODB_ENDPOINT_URL = os.environ.get("DYNAMODB_ENDPOINT_URL")
+# Set to "true" to trace DynamoDB calls with the X-Ray SDK. Importing the
+# SDK is the slowest part of a cold start, so it is off by default; the
+# invocation itself is traced by Lambda either way.
+TRACE_AWS_CALLS = os.environ.get("TRACE_AWS_CALLS", "").lower() in (
+    "1",
+    "true",
+)
+
+_store: Optional[game_store.GameStore] = None
+
+# Attempts at a read-modify-write that keeps losing to concurrent writers,
+# with full-jitter exponential backoff between them
+MAX_ATTEMPTS = 5
+BACKOFF_BASE = 0.02
+BACKOFF_MAX = 0.4
+# Attempts at a BOT_TURN, which all share the bot's one time budget
+BOT_MAX_ATTEMPTS = 3
+
+# Attributes of the game item that hold the game, as written by
+# update_game
+GAME_ATTRIBUTES = (
+    "current_disasters",
+    "previous_disasters",
+    "players",
+    "turn_order",
+    "turn_index",
+    "shop",
+    "discard",
+    "deck",
+    "rng_state",
+)
+
+# Attempts at drawing a join code no other lobby has
+JOIN_CODE_ATTEMPTS = 5
+# Join codes resolved to lobby keys by this container, oldest first
+JOIN_CODE_CACHE_SIZE = 1024
+_join_codes: Dict[str, Tuple[str, int]] = {}
 
 NUM_DISASTER_DEFAULT = 6
 NUM_CATASTROPHES_DEFAULT = 0
 NUM_SAFE_DEFAULT = 15
 
 
+def get_store() -> game_store.GameStore:
+    """
+    The store games are kept in, opened on first use
+    """
+    global _store
+    if _store is None:
+        _store = game_store.open_store(
+            GAME_STORE, GAME_TABLE_NAME, DYNAMODB_ENDPOINT_URL, TRACE_AWS_CALLS
+        )
+    return _store
+
+
+def retry_on_conflict(
+    attempt: Callable[[], Dict], max_attempts: Optional[int] = None
+) -> Dict:
+    """
+    Runs attempt, which reads items, applies a change and writes it back
+    conditionally, until its write does not conflict with a concurrent one
+    or max_attempts (MAX_ATTEMPTS by default) have failed
+    """
+    if max_attempts is None:
+        max_attempts = MAX_ATTEMPTS
+    for n in range(max_attempts):
+        try:
+            return attempt()
+        except game_store.ConflictError:
+            if n + 1 < max_attempts:
+                delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** n)
+                time.sleep(random.uniform(0, delay))
+    return actions.error(actions.CONFLICT, "Too many concurrent updates")
+
+
 def lambda_handler(event, context):
-    logger.info(
-        "## ENVIRONMENT VARIABLES\r" + jsonpickle.encode(dict(**os.environ))
-    )
-    logger.info("## EVENT\r" + jsonpickle.encode(event))
-    logger.info("## CONTEXT\r" + jsonpickle.encode(context))
-
-    if event["action"] == "CREATE_LOBBY":
-        return create_lobby(event)
-    elif event["action"] == "JOIN_LOBBY":
-        return join_lobby(event)
-    elif event["action"] == "MODIFY_LOBBY":
-        return modify_lobby(event)
-    elif event["action"] == "READY_LOBBY":
-        return ready_lobby(event)
-    elif event["action"] == "START_GAME":
-        return start_game(event)
-    elif event["action"] == "GET_GAME_INFO":
-        return get_game_info(event)
-    elif event["action"] == "ACTION_DISCARD":
-        return discard(event)
-    elif event["action"] == "ACTION_SHOP":
-        return shop(event)
-    elif event["action"] == "ACTION_MOVE":
-        return move(event)
-    elif event["action"] == "ACTION_SWAP":
-        return swap(event)
-    return {}
+    request = request_log.Request(event, context)
+    try:
+        result = actions.dispatch(event)
+    except Exception:
+        request.fail()
+        raise
+    request.finish(result)
+    return result
+
 
+# Fields shared by the schemas of actions on an existing game or lobby
+GAME_FIELDS = {"game_id": "str", "game_timestamp": "int"}
+PLAYER_FIELDS = dict(GAME_FIELDS, player_id="str")
+PLACEMENT_FIELDS = dict(
+    PLAYER_FIELDS, room_id="room_id", x="int", y="int", rotation="int"
+)
 
+
+@action("ACTION_DISCARD", dict(PLAYER_FIELDS, discard_list="int_list"))
 def discard(event) -> Dict:
-    if (
-        "game_id" not in event
-        or "game_timestamp" not in event
-        or "player_id" not in event
-        or "discard_list" not in event
-    ):
-        return {}
-    response = game_table.get_item(
-        Key={"id": event["game_id"], "timestamp": event["game_timestamp"]}
-    )
-    if response["Item"]["game_state"] != "PLAYING":
-        return {}
-    game_info = Game.from_json_obj(response["Item"])
-    game_info = manager.action_discard(
-        game_info, event["player_id"], event["discard_list"]
-    )
-    if manager.is_game_ended(game_info):
-        update_game(
-            event["game_id"], event["game_timestamp"], game_info, "ENDED"
-        )
-    else:
-        update_game(
-            event["game_id"], event["game_timestamp"], game_info, "PLAYING"
-        )
-    return {
-        "player_id": event["player_id"],
-        "game_id": event["game_id"],
-        "game_timestamp": event["game_timestamp"],
-    }
+    return play_action(event)
 
 
+@action("ACTION_SHOP", PLACEMENT_FIELDS)
 def shop(event) -> Dict:
-    if (
-        "game_id" not in event
-        or "game_timestamp" not in event
-        or "player_id" not in event
-        or "room_id" not in event
-        or "x" not in event
-        or "y" not in event
-        or "rotation" not in event
-    ):
-        return {}
-    response = game_table.get_item(
-        Key={"id": event["game_id"], "timestamp": event["game_timestamp"]}
-    )
-    if response["Item"]["game_state"] != "PLAYING":
-        return {}
-    game_info = Game.from_json_obj(response["Item"])
-    game_info = manager.action_shop(
-        game_info,
-        event["player_id"],
-        event["room_id"],
-        event["x"],
-        event["y"],
-        event["rotation"],
-    )
-    update_game(
-        event["game_id"], event["game_timestamp"], game_info, "PLAYING"
-    )
-    return {
-        "player_id": event["player_id"],
-        "game_id": event["game_id"],
-        "game_timestamp": event["game_timestamp"],
-    }
+    return play_action(event)
 
 
+@action("ACTION_MOVE", PLACEMENT_FIELDS)
 def move(event) -> Dict:
-    if (
-        "game_id" not in event
-        or "game_timestamp" not in event
-        or "player_id" not in event
-        or "room_id" not in event
-        or "x" not in event
-        or "y" not in event
-        or "rotation" not in event
-    ):
-        return {}
-    response = game_table.get_item(
-        Key={"id": event["game_id"], "timestamp": event["game_timestamp"]}
-    )
-    if response["Item"]["game_state"] != "PLAYING":
-        return {}
-    game_info = Game.from_json_obj(response["Item"])
-    game_info = manager.action_move(
-        game_info,
-        event["player_id"],
-        event["room_id"],
-        event["x"],
-        event["y"],
-        event["rotation"],
-    )
-    update_game(
-        event["game_id"], event["game_timestamp"], game_info, "PLAYING"
-    )
-    return {
-        "player_id": event["player_id"],
-        "game_id": event["game_id"],
-        "game_timestamp": event["game_timestamp"],
-    }
+    return play_action(event)
+
+
+@action(
+    "ACTION_SWAP",
+    dict(
+        PLAYER_FIELDS,
+        room_id_a="room_id",
+        room_id_b="room_id",
+        rotation_a="int",
+        rotation_b="int",
+    ),
+)
+def swap(event) -> Dict:
+    return play_action(event)
 
 
-def swap(event) -> Dict:
-    if (
-        "game_id" not in event
-        or "game_timestamp" not in event
-        or "player_id" not in event
-        or "room_id_a" not in event
-        or "room_id_b" not in event
-        or "rotation_a" not in event
-        or "rotation_b" not in event
-    ):
-        return {}
-    response = game_table.get_item(
-        Key={"id": event["game_id"], "timestamp": event["game_timestamp"]}
-    )
-    if response["Item"]["game_state"] != "PLAYING":
-        return {}
-    game_info = Game.from_json_obj(response["Item"])
-    game_info = manager.action_move(
-        game_info,
-        event["player_id"],
-        event["room_id_a"],
-        event["room_id_b"],
-        event["rotation_a"],
-        event["rotation_b"],
-    )
-    update_game(
-        event["game_id"], event["game_timestamp"], game_info, "PLAYING"
+@action("BOT_TURN", PLAYER_FIELDS, {"time_budget": "number"})
+def bot_turn(event) -> Dict:
+    """
+    Lets the built-in AI take player_id's next action. The chosen action is
+    logged like any other, so replays do not rerun the search.
+    """
+    import bot
+
+    time_budget = min(
+        float(event.get("time_budget", bot.DEFAULT_TIME_BUDGET)),
+        bot.MAX_TIME_BUDGET,
     )
-    return {
-        "player_id": event["player_id"],
+    deadline = time.perf_counter() + time_budget
+
+    def choose_record(game_info: "Game") -> Optional[Dict]:
+        # A retry after a conflict only gets the time left, so the whole
+        # turn stays within one budget
+        remaining = max(0.0, deadline - time.perf_counter())
+        return bot.choose_action(game_info, event["player_id"], remaining)
+
+    return play_action(event, choose_record, BOT_MAX_ATTEMPTS)
+
+
+def play_action(
+    event,
+    choose_record: Callable[["Game"], Optional[Dict]] = None,
+    max_attempts: Optional[int] = None,
+) -> Dict:
+    """
+    Applies a game action and appends it to the game's action log. The
+    action is taken from the event unless choose_record picks one from the
+    loaded game, in which case it picks again on every retry.
+    """
+    import action_log
+    import manager
+
+    def attempt() -> Dict:
+        loaded = load_game(event["game_id"], event["game_timestamp"])
+        if loaded is None:
+            return actions.error(actions.NOT_FOUND, "No started game")
+        game_info, seq, game_state, item = loaded
+        if game_state != "PLAYING":
+            return actions.error(actions.WRONG_STATE, "Game is not playing")
+        if event["player_id"] not in game_info.players:
+            return actions.error(actions.NOT_A_PLAYER, "Not in this game")
+        if choose_record is None:
+            record = action_log.to_record(event)
+        else:
+            record = choose_record(game_info)
+            if record is None:
+                return actions.error(actions.REJECTED, "No action to take")
+        game_info = action_log.apply_if_legal(game_info, record)
+        if game_info is None:
+            # Nothing to log: the game is as it was
+            return actions.error(actions.REJECTED, "Action not allowed")
+        if manager.is_game_ended(game_info):
+            game_state = "ENDED"
+        save_action(
+            event["game_id"],
+            event["game_timestamp"],
+            seq + 1,
+            record,
+            game_info,
+            game_state,
+            item,
+        )
+        return {
+            "player_id": event["player_id"],
+            "game_id": event["game_id"],
+            "game_timestamp": event["game_timestamp"],
+        }
+
+    # Losing the race for the next sequence number means another action
+    # went first, so the action is applied again on top of it
+    return retry_on_conflict(attempt, max_attempts)
+
+
+@action("GET_GAME_INFO", GAME_FIELDS, {"player_id": "str"})
+def get_game_info(event) -> Dict:
+    import manager
+
+    loaded = load_game(event["game_id"], event["game_timestamp"])
+    if loaded is None:
+        return actions.error(actions.NOT_FOUND, "No started game")
+    game_info, seq, _, _ = loaded
+    result = {
         "game_id": event["game_id"],
         "game_timestamp": event["game_timestamp"],
+        "game_info": game_info.to_public_json_obj(),
+        "action_seq": seq,
     }
+    if "player_id" in event and event["player_id"] in game_info.players:
+        placements = manager.shop_placements(game_info, event["player_id"])
+        result["shop_placements"] = {
+            str(room_id): [list(p) for p in placements[room_id]]
+            for room_id in placements
+        }
+        result["discard_options"] = manager.discard_options(
+            game_info, event["player_id"]
+        )
+    return result
 
 
-def get_game_info(event) -> Dict:
-    if "game_id" not in event or "game_timestamp" not in event:
-        return {}
-    response = game_table.get_item(
-        Key={"id": event["game_id"], "timestamp": event["game_timestamp"]}
-    )
-    game_info = Game.from_json_obj(response["Item"])
+@action("GET_GAME_REPLAY", dict(GAME_FIELDS, action_seq="int"))
+def get_game_replay(event) -> Dict:
+    """
+    Public state of the game as it was after action number action_seq
+    """
+    game_info = load_game_at(event["game_id"], int(event["action_seq"]))
+    if game_info is None:
+        return actions.error(actions.NOT_FOUND, "No such game or action")
     return {
         "game_id": event["game_id"],
         "game_timestamp": event["game_timestamp"],
         "game_info": game_info.to_public_json_obj(),
+        "action_seq": int(event["action_seq"]),
     }
 
 
+@action("START_GAME", PLAYER_FIELDS)
 def start_game(event) -> Dict[str, str]:
-    if (
-        "game_id" not in event
-        or "game_timestamp" not in event
-        or "player_id" not in event
-    ):
-        return {}
-    response = game_table.get_item(
-        Key={"id": event["game_id"], "timestamp": event["game_timestamp"]}
-    )
-    game_info = response["Item"]
-    players_info = game_info["players"]
-
-    # Check ready: already chosen throne_room_id
-    if event["player_id"] not in players_info or any(
-        "throne_room_id" not in players_info[player] for player in players_info
-    ):
-        return {}
-    game = manager.create_game(
-        players_info,
-        int(game_info["num_disasters"]),
-        int(game_info["num_catastrophes"]),
-        int(game_info["num_safe"]),
+    import manager
+
+    def attempt() -> Dict:
+        lobby = get_store().get(event["game_id"], event["game_timestamp"])
+        problem = _lobby_error(lobby, event["player_id"])
+        if problem is not None:
+            return problem
+        players_info = lobby["players"]
+        # Check ready: already chosen throne_room_id
+        if any(
+            "throne_room_id" not in players_info[player]
+            for player in players_info
+        ):
+            return actions.error(actions.REJECTED, "Not every player is ready")
+        game = manager.create_game(
+            players_info,
+            int(lobby["num_disasters"]),
+            int(lobby["num_catastrophes"]),
+            int(lobby["num_safe"]),
+        )
+        # Fails if the lobby changed or another START_GAME won
+        save_snapshot(
+            event["game_id"],
+            event["game_timestamp"],
+            0,
+            game,
+            "PLAYING",
+            lobby,
+        )
+        return {
+            "player_id": event["player_id"],
+            "game_id": event["game_id"],
+            "game_timestamp": event["game_timestamp"],
+        }
+
+    return retry_on_conflict(attempt)
+
+
+def _lobby_error(item: Optional[Dict], player_id: str) -> Optional[Dict]:
+    """
+    Error response unless the item is a lobby player_id is in
+    """
+    if item is None:
+        return actions.error(actions.NOT_FOUND, "No such lobby")
+    if item["game_state"] != "LOBBY":
+        return actions.error(actions.WRONG_STATE, "Game already started")
+    if player_id not in item["players"]:
+        return actions.error(actions.NOT_A_PLAYER, "Not in this lobby")
+    return None
+
+
+def _expected_version(item: Dict) -> Dict[str, object]:
+    """
+    Condition that the item still has the version it was read with
+    """
+    # Items written before versioning was added have none
+    return {"version": item.get("version", game_store.ABSENT)}
+
+
+def update_lobby(item: Dict, sets: List[Tuple[item_diff.Path, object]]):
+    """
+    Sets attribute paths of a lobby item read earlier and bumps its
+    version. Raises game_store.ConflictError if the item was changed since
+    it was read.
+    """
+    get_store().update(
+        item["id"],
+        item["timestamp"],
+        sets + [(("version",), int(item.get("version", 0)) + 1)],
+        expected=_expected_version(item),
     )
-    update_game(event["game_id"], event["game_timestamp"], game, "PLAYING")
-    return {
-        "player_id": event["player_id"],
-        "game_id": event["game_id"],
-        "game_timestamp": event["game_timestamp"],
-    }
 
 
+@action("READY_LOBBY", dict(PLAYER_FIELDS, throne_room_id="int"))
 def ready_lobby(event) -> Dict[str, str]:
-    if (
-        "game_id" not in event
-        or "game_timestamp" not in event
-        or "player_id" not in event
-        or "throne_room_id" not in event
-    ):
-        return {}
-    response = game_table.get_item(
-        Key={"id": event["game_id"], "timestamp": event["game_timestamp"]}
-    )
-    if response["Item"]["game_state"] != "LOBBY":
-        return {}
-    players_info = response["Item"]["players"]
-    if event["player_id"] not in players_info:
-        return {}
-    chosen_throne_room_ids = set()
-    for player_id in players_info:
-        if "throne_room_id" in players_info[player_id]:
-            throne_room_id = players_info[player_id]["throne_room_id"]
-            chosen_throne_room_ids.add(throne_room_id)
-
-    if event["throne_room_id"] in chosen_throne_room_ids:
-        return {}
-    players_info[event["player_id"]]["throne_room_id"] = event[
-        "throne_room_id"
-    ]
-    game_table.update_item(
-        Key={"id": event["game_id"], "timestamp": event["game_timestamp"]},
-        UpdateExpression="SET players = :updated_players",
-        ExpressionAttributeValues={":updated_players": players_info},
-    )
-    return {
-        "player_id": event["player_id"],
-        "game_id": event["game_id"],
-        "game_timestamp": event["game_timestamp"],
-    }
+    def attempt() -> Dict:
+        lobby = get_store().get(event["game_id"], event["game_timestamp"])
+        problem = _lobby_error(lobby, event["player_id"])
+        if problem is not None:
+            return problem
+        players_info = lobby["players"]
+        chosen_throne_room_ids = set()
+        for player_id in players_info:
+            if "throne_room_id" in players_info[player_id]:
+                throne_room_id = players_info[player_id]["throne_room_id"]
+                chosen_throne_room_ids.add(throne_room_id)
+
+        if event["throne_room_id"] in chosen_throne_room_ids:
+            return actions.error(actions.REJECTED, "Throne room already taken")
+        update_lobby(
+            lobby,
+            [
+                (
+                    ("players", event["player_id"], "throne_room_id"),
+                    event["throne_room_id"],
+                )
+            ],
+        )
+        return {
+            "player_id": event["player_id"],
+            "game_id": event["game_id"],
+            "game_timestamp": event["game_timestamp"],
+        }
 
+    return retry_on_conflict(attempt)
 
+
+@action(
+    "MODIFY_LOBBY",
+    dict(
+        PLAYER_FIELDS,
+        num_disasters="int",
+        num_catastrophes="int",
+        num_safe="int",
+    ),
+)
 def modify_lobby(event) -> Dict[str, str]:
-    if (
-        "game_id" not in event
-        or "game_timestamp" not in event
-        or "player_id" not in event
-        or "num_disasters" not in event
-        or "num_catastrophes" not in event
-        or "num_safe" not in event
-    ):
-        return {}
-    response = game_table.get_item(
-        Key={"id": event["game_id"], "timestamp": event["game_timestamp"]}
-    )
-    if response["Item"]["game_state"] != "LOBBY":
-        return {}
-    players_info = response["Item"]["players"]
-    if event["player_id"] not in players_info:
-        return {}
-    game_table.update_item(
-        Key={"id": event["game_id"], "timestamp": event["game_timestamp"]},
-        UpdateExpression="SET num_disasters = :disasters, \
-                              num_catastrophes = :catastrophes, \
-                              num_safe = :safe",
-        ExpressionAttributeValues={
-            ":disasters": event["num_disasters"],
-            ":catstrophes": event["num_catastrophes"],
-            ":safe": event["num_safe"],
-        },
-    )
-    return {
-        "player_id": event["player_id"],
-        "game_id": event["game_id"],
-        "game_timestamp": event["game_timestamp"],
-    }
+    def attempt() -> Dict:
+        lobby = get_store().get(event["game_id"], event["game_timestamp"])
+        problem = _lobby_error(lobby, event["player_id"])
+        if problem is not None:
+            return problem
+        update_lobby(
+            lobby,
+            [
+                (("num_disasters",), event["num_disasters"]),
+                (("num_catastrophes",), event["num_catastrophes"]),
+                (("num_safe",), event["num_safe"]),
+            ],
+        )
+        return {
+            "player_id": event["player_id"],
+            "game_id": event["game_id"],
+            "game_timestamp": event["game_timestamp"],
+        }
 
+    return retry_on_conflict(attempt)
 
-def join_lobby(event) -> Dict[str, str]:
-    if "game_id" not in event or "username" not in event:
-        return {}
-    game_id = event["game_id"]
-    response = game_table.query(KeyConditionExpression=Key("id").eq(game_id))
-    if (
-        len(response["Items"]) == 0
-        or response["Items"][0]["game_state"] != "LOBBY"
-    ):
-        return {}
-    timestamp = response["Items"][0]["timestamp"]
 
-    player_id = str(uuid.uuid4())
-    username = event["username"]
+def find_lobby(code: str) -> Optional[Tuple[str, int]]:
+    """
+    Key of the lobby a normalized join code belongs to, or None if there is
+    none. Codes never move to another lobby, so they are cached for the
+    life of the container.
+    """
+    if code not in _join_codes:
+        item = get_store().get(join_code.item_id(code), 0)
+        if item is None:
+            return None
+        _cache_join_code(code, item["game_id"], int(item["game_timestamp"]))
+    return _join_codes[code]
 
-    updated_players = response["Items"][0]["players"]
-    updated_players[player_id] = {"username": username}
 
-    game_table.update_item(
-        Key={"id": game_id, "timestamp": timestamp},
-        UpdateExpression="SET players = :updated_players",
-        ExpressionAttributeValues={":updated_players": updated_players},
-    )
+def _cache_join_code(code: str, game_id: str, timestamp: int):
+    if len(_join_codes) >= JOIN_CODE_CACHE_SIZE:
+        del _join_codes[next(iter(_join_codes))]
+    _join_codes[code] = (game_id, timestamp)
 
-    return {
-        "player_id": player_id,
-        "game_id": game_id,
-        "game_timestamp": timestamp,
-    }
 
+@action(
+    "JOIN_LOBBY",
+    {"username": "str"},
+    {"join_code": "str", "game_id": "str", "game_timestamp": "int"},
+)
+def join_lobby(event) -> Dict[str, str]:
+    if "join_code" in event:
+        code = join_code.normalize(event["join_code"])
+        if code is None:
+            return actions.error(
+                actions.INVALID_FIELD, "Invalid join_code", field="join_code"
+            )
+        key = find_lobby(code)
+        if key is None:
+            return actions.error(actions.NOT_FOUND, "No such lobby")
+        game_id, timestamp = key
+    elif "game_id" in event:
+        game_id = event["game_id"]
+        timestamp = event.get("game_timestamp")
+    else:
+        return actions.error(
+            actions.MISSING_FIELD, "Missing join_code", field="join_code"
+        )
+    player_id = str(uuid.uuid4())
+
+    def attempt() -> Dict:
+        if timestamp is None:
+            # Only the game id is known, so its timestamp has to be queried
+            items = get_store().query(game_id, limit=1)
+            lobby = items[0] if len(items) > 0 else None
+        else:
+            lobby = get_store().get(game_id, timestamp)
+        if lobby is None:
+            return actions.error(actions.NOT_FOUND, "No such lobby")
+        if lobby["game_state"] != "LOBBY":
+            return actions.error(actions.WRONG_STATE, "Game already started")
+
+        update_lobby(
+            lobby,
+            [(("players", player_id), {"username": event["username"]})],
+        )
+        return {
+            "player_id": player_id,
+            "game_id": game_id,
+            "game_timestamp": lobby["timestamp"],
+        }
 
+    return retry_on_conflict(attempt)
+
+
+@action("CREATE_LOBBY", {"username": "str"})
 def create_lobby(event) -> Dict[str, str]:
-    if "username" not in event:
-        return {}
     game_id = str(uuid.uuid4())
     timestamp = int(datetime.now().timestamp())
     player_id = str(uuid.uuid4())
-    game_table.put_item(
-        Item={
+    code = claim_join_code(game_id, timestamp)
+    get_store().put(
+        {
             "id": game_id,
             "timestamp": timestamp,
+            "join_code": code,
             "players": {player_id: {"username": event["username"]}},
             "game_state": "LOBBY",
+            "version": 0,
             "num_disasters": NUM_DISASTER_DEFAULT,
             "num_catastrophes": NUM_CATASTROPHES_DEFAULT,
             "num_safe": NUM_SAFE_DEFAULT,
@@ -377,33 +505,211 @@ def create_lobby(event) -> Dict[str, str]:
         "player_id": player_id,
         "game_id": game_id,
         "game_timestamp": timestamp,
+        "join_code": code,
     }
 
 
+def claim_join_code(game_id: str, timestamp: int) -> str:
+    """
+    Stores a new join code for the lobby, drawing again if another lobby
+    already has it
+    """
+    for _ in range(JOIN_CODE_ATTEMPTS):
+        code = join_code.generate()
+        try:
+            get_store().put(
+                {
+                    "id": join_code.item_id(code),
+                    "timestamp": 0,
+                    "game_id": game_id,
+                    "game_timestamp": timestamp,
+                },
+                if_absent=True,
+            )
+        except game_store.ConflictError:
+            continue
+        _cache_join_code(code, game_id, timestamp)
+        return code
+    raise RuntimeError("No free join code")
+
+
+def load_game(
+    game_id: str, timestamp: int
+) -> Optional[Tuple["Game", int, str, Dict]]:
+    """
+    Latest game state: the snapshot in the game item with the logged
+    actions after it replayed. Returns the game, the sequence number of its
+    last action, the game state and the game item as read, or None if the
+    game has not started.
+    """
+    import action_log
+    from model import Game
+
+    item = get_store().get(game_id, timestamp)
+    if item is None or item["game_state"] == "LOBBY":
+        return None
+    # The game shares lists and maps with what it is built from, and the
+    # item is kept unchanged as the base of the next write
+    game_info = Game.from_json_obj(copy.deepcopy(item))
+    seq = int(item.get("snapshot_seq", 0))
+    for log_item in read_log(game_id, seq):
+        game_info = action_log.apply_action(game_info, log_item["action"])
+        seq = int(log_item["timestamp"])
+    return game_info, seq, item["game_state"], item
+
+
+def load_game_at(game_id: str, seq: int) -> Optional["Game"]:
+    """
+    Rebuilds the game as it was after action seq from the nearest earlier
+    snapshot
+    """
+    import action_log
+    from model import Game
+
+    snapshots = get_store().query(
+        action_log.snapshot_id(game_id), up_to=seq, newest_first=True, limit=1
+    )
+    if len(snapshots) == 0:
+        return None
+    snapshot = snapshots[0]
+    game_info = Game.from_json_obj(snapshot["game"])
+    records = [
+        log_item["action"]
+        for log_item in read_log(game_id, int(snapshot["timestamp"]), seq)
+    ]
+    return action_log.replay(game_info, records)
+
+
+def read_log(
+    game_id: str, after_seq: int, up_to: Optional[int] = None
+) -> List[Dict]:
+    """
+    Logged actions with a sequence number above after_seq and at most
+    up_to, oldest first
+    """
+    import action_log
+
+    return get_store().query(
+        action_log.log_id(game_id), after=after_seq, up_to=up_to
+    )
+
+
+def save_action(
+    game_id: str,
+    timestamp: int,
+    seq: int,
+    record: Dict,
+    game_info: "Game",
+    game_state: str,
+    base: Optional[Dict] = None,
+):
+    """
+    Appends an action to the log, failing if seq is already taken, and
+    snapshots the game every action_log.SNAPSHOT_INTERVAL actions or when
+    it ends. base is the game item the action was applied on top of.
+    """
+    import action_log
+
+    get_store().put(
+        {"id": action_log.log_id(game_id), "timestamp": seq, "action": record},
+        if_absent=True,
+    )
+    if game_state != "PLAYING" or action_log.is_snapshot_due(seq):
+        save_snapshot(
+            game_id, timestamp, seq, game_info, game_state, base=base
+        )
+
+
+def save_snapshot(
+    game_id: str,
+    timestamp: int,
+    seq: int,
+    game_info: "Game",
+    game_state: str,
+    lobby: Optional[Dict] = None,
+    base: Optional[Dict] = None,
+):
+    """
+    Stores the game as of action seq in the game item and as a snapshot
+    item. The first snapshot, taken when the game starts from lobby, is
+    only written if the lobby is unchanged and raises
+    game_store.ConflictError otherwise.
+    """
+    import action_log
+
+    try:
+        update_game(
+            game_id, timestamp, game_info, game_state, seq, lobby, base
+        )
+    except game_store.ConflictError:
+        if lobby is not None:
+            raise
+        if base is not None:
+            # The item changed since base was read, so the diff does not
+            # apply to it. Write the whole game instead.
+            try:
+                update_game(game_id, timestamp, game_info, game_state, seq)
+            except game_store.ConflictError:
+                pass
+        # Otherwise a concurrent writer already stored a later snapshot
+    get_store().put(
+        {
+            "id": action_log.snapshot_id(game_id),
+            "timestamp": seq,
+            "game": game_info.to_json_obj(),
+            "game_state": game_state,
+        }
+    )
+
+
 def update_game(
-    game_id: str, timestamp: int, game_info: Game, game_state: str
+    game_id: str,
+    timestamp: int,
+    game_info: "Game",
+    game_state: str,
+    snapshot_seq: int,
+    lobby: Optional[Dict] = None,
+    base: Optional[Dict] = None,
 ):
+    """
+    Writes the game into its item, bumping the item's version. Given the
+    item as it was read (base), only the attribute paths that differ from
+    it are written, such as one player's castle, and the write fails if
+    the item changed since. Otherwise whole attributes are written and the
+    item only moves forward: the write fails if it already holds a later
+    snapshot or, when starting from lobby, if the lobby changed since it
+    was read.
+    """
     game_json = game_info.to_json_obj()
-    game_table.update_item(
-        Key={"id": game_id, "timestamp": timestamp},
-        UpdateExpression="SET game_state = :new_state, \
-                              current_disasters = :c_disasters, \
-                              previous_disasters = :p_disasters, \
-                              players = :players_info, \
-                              turn_order = :t_order, \
-                              turn_index = :t_index, \
-                              shop = :game_shop, \
-                              discard = :game_discard, \
-                              deck = :game_deck",
-        ExpressionAttributeValues={
-            ":new_state": game_state,
-            ":c_disasters": game_json["current_disasters"],
-            ":p_disasters": game_json["previous_disasters"],
-            ":players_info": game_json["players"],
-            ":t_order": game_json["turn_order"],
-            ":t_index": game_json["turn_index"],
-            ":game_shop": game_json["shop"],
-            ":game_discard": game_json["discard"],
-            ":game_deck": game_json["deck"],
-        },
+    sets, removes = item_diff.diff(
+        base if base is not None else {}, game_json, GAME_ATTRIBUTES
+    )
+    sets += [(("game_state",), game_state), (("snapshot_seq",), snapshot_seq)]
+    expression, _, _ = item_diff.update_expression(sets, removes)
+    if len(expression) > item_diff.MAX_EXPRESSION_LENGTH:
+        # Too many scattered changes for DynamoDB to take in one
+        # expression, so replace whole attributes
+        sets = [((key,), game_json[key]) for key in GAME_ATTRIBUTES] + sets[
+            -2:
+        ]
+        removes = []
+    if lobby is not None:
+        expected = dict(_expected_version(lobby), game_state="LOBBY")
+        below = None
+    elif base is not None:
+        expected = {
+            "snapshot_seq": base.get("snapshot_seq", game_store.ABSENT)
+        }
+        below = None
+    else:
+        expected = None
+        below = {"snapshot_seq": snapshot_seq}
+    get_store().update(
+        game_id,
+        timestamp,
+        sets,
+        removes,
+        add={"version": 1},
+        expected=expected,
+        below=below,
     )
@@ -1,13 +1,16 @@
-import random
-from typing import List
+from typing import Dict, List, Optional
 
-from model import Castle, Game, Player
+import batch
+import cards
+import disasters
+from model import Castle, Game, Player, new_rng
 from data.room_list import ROOM_LIST
 from data.disaster_list import DISASTER_LIST
 
 
 SHOP_SIZE = 5
 THRONE_ROOM_ID_START = 101
+DISCARD_OPTIONS_LIMIT = 10
 
 
 def is_game_ended(game_info: Game) -> bool:
@@ -20,18 +23,15 @@ def is_game_ended(game_info: Game) -> bool:
 def action_discard(
     game_info: Game, player_id: str, discard_list: List[str]
 ) -> Game:
-    if (
-        len(game_info.current_disasters) == 0
-        or player_damage(game_info, player_id) == 0
-        or len(discard_list) != player_damage(game_info, player_id)
-    ):
+    damage = player_damage(game_info, player_id)
+    if damage == 0 or len(discard_list) != damage:
         return game_info
-    copied_castle = game_info.players[player_id].castle.copy()
-    try:
-        copied_castle.discard(*discard_list)
-    except RuntimeError:
+    castle = game_info.players[player_id].castle
+    # Accept the rooms in any order that can be discarded one by one
+    discard_order = castle.discard_order([int(r) for r in discard_list])
+    if discard_order is None:
         return game_info
-    game_info.players[player_id].discard_list = discard_list
+    game_info.players[player_id].discard_list = discard_order
     game_info = resolve_disaster(game_info)
     return game_info
 
@@ -90,48 +90,100 @@ def action_swap(
     return game_info
 
 
-def translate_disaster_connection_damage(
-    encoding: str, num_previous_disasters: int
-) -> int:
-    damage = 0
-    for term in encoding.split("+"):
-        if "x" in term:
-            damage += int(term.strip("x")) * num_previous_disasters
-        else:
-            damage += int(term)
-    return damage
+def shop_placements(game_info: Game, player_id: str) -> dict:
+    """
+    Legal (x, y, rotation) placements of every shop room in the player's
+    castle, keyed by room id
+    """
+    castle = game_info.players[player_id].castle
+    return {
+        room_id: castle.legal_placements(room_id)
+        for room_id in game_info.shop
+    }
+
+
+def discard_options(
+    game_info: Game, player_id: str, limit: int = DISCARD_OPTIONS_LIMIT
+) -> List[List[int]]:
+    """
+    Valid discard lists covering the player's current damage, best first
+    """
+    damage = player_damage(game_info, player_id)
+    if damage == 0 or len(game_info.players[player_id].discard_list) > 0:
+        return []
+    return game_info.players[player_id].castle.discard_sets(damage, limit)
 
 
 def disaster_damage(game_info: Game, disaster_id: str, player_id: str) -> int:
-    num_previous_disasters = len(game_info.previous_disasters)
-    diamond_damage = translate_disaster_connection_damage(
-        DISASTER_LIST[disaster_id]["diamond"], num_previous_disasters
+    requirements = disasters.requirements(
+        disaster_id, len(game_info.previous_disasters)
     )
-    cross_damage = translate_disaster_connection_damage(
-        DISASTER_LIST[disaster_id]["cross"], num_previous_disasters
-    )
-    moon_damage = translate_disaster_connection_damage(
-        DISASTER_LIST[disaster_id]["moon"], num_previous_disasters
+    castle = game_info.players[player_id].castle
+    return int(batch.disaster_damage(castle.num_connections(), requirements))
+
+
+def _damage_key(game_info: Game, player_id: str) -> tuple:
+    """
+    Everything a player's damage depends on. Castle.version changes on every
+    castle mutation and the disaster fields change when one resolves.
+    """
+    return (
+        game_info.players[player_id].castle.version,
+        game_info.current_disasters[0],
+        len(game_info.previous_disasters),
     )
-    diamond, cross, moon, wild = game_info.players[player_id].castle
-    diamond_damage = max(diamond_damage - diamond, 0)
-    cross_damage = max(cross_damage - cross, 0)
-    moon_damage = max(moon_damage - moon, 0)
-    return max(diamond_damage + cross_damage + moon_damage - wild, 0)
 
 
 def player_damage(game_info: Game, player_id: str) -> int:
     if len(game_info.current_disasters) == 0:
         return 0
-    return disaster_damage(
+    key = _damage_key(game_info, player_id)
+    cached = game_info.damage_cache.get(player_id)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+    damage = disaster_damage(
         game_info, game_info.current_disasters[0], player_id
     )
+    game_info.damage_cache[player_id] = (key, damage)
+    return damage
+
+
+def all_player_damage(game_info: Game) -> Dict[str, int]:
+    """
+    Damage the current disaster deals to every player. Players without an
+    up to date cached value are computed together in one pass.
+    """
+    if len(game_info.current_disasters) == 0:
+        return {player_id: 0 for player_id in game_info.players}
+    damage = {}
+    stale = []
+    for player_id in game_info.players:
+        key = _damage_key(game_info, player_id)
+        cached = game_info.damage_cache.get(player_id)
+        if cached is not None and cached[0] == key:
+            damage[player_id] = cached[1]
+        else:
+            stale.append((player_id, key))
+    if len(stale) > 0:
+        requirements = disasters.requirements(
+            game_info.current_disasters[0], len(game_info.previous_disasters)
+        )
+        links = [
+            game_info.players[player_id].castle.num_connections()
+            for player_id, _ in stale
+        ]
+        computed = batch.disaster_damage(links, requirements).tolist()
+        for (player_id, key), value in zip(stale, computed):
+            game_info.damage_cache[player_id] = (key, value)
+            damage[player_id] = value
+    return damage
 
 
 def all_discard_complete(game_info: Game):
+    damage = all_player_damage(game_info)
     for player_id in game_info.players:
         num_discarded = len(game_info.players[player_id].discard_list)
-        if player_damage(game_info, player_id) - num_discarded > 0:
+        if damage[player_id] - num_discarded > 0:
             return False
     return True
 
@@ -151,12 +203,26 @@ def pass_turn(game_info: Game) -> Game:
     if game_info.turn_index >= len(game_info.turn_order):
         game_info.turn_index = 0
         game_info.turn_order = (
-            game_info.turn_order[1:] + game_info.turn_order[0]
+            game_info.turn_order[1:] + game_info.turn_order[:1]
         )
         game_info = restock_shop(game_info)
     return game_info
 
 
+def _draw_card(game_info: Game) -> int:
+    if len(game_info.deck) > 0:
+        return game_info.deck.pop()
+    # Randomly take from discard pile if deck is empty
+    return cards.draw_random(game_info.discard, game_info.rng)
+
+
+def _deal_card(game_info: Game, code: int):
+    if cards.is_disaster_card(code):
+        game_info.current_disasters.append(cards.decode_card(code))
+    else:
+        game_info.shop.append(code)
+
+
 def restock_shop(game_info: Game) -> Game:
     """
     Discard current shop, restock shop and put aside any disasters
@@ -169,37 +235,23 @@ def restock_shop(game_info: Game) -> Game:
     game_info.shop = []
     # Deal shop
     while len(game_info.shop) < SHOP_SIZE and len(game_info.deck) > 0:
-        if len(game_info.deck) > 0:
-            card = game_info.deck.pop()
-        else:
-            # Randomly take from discard pile if deck is empty
-            discard_index = random.choice(range(len(game_info.discard)))
-            card = game_info.discard.pop(discard_index)
-        if card[0] == "d" or card[0] == "c":
-            game_info.current_disasters.append(card)
-        else:
-            game_info.shop.append(int(card))
+        _deal_card(game_info, _draw_card(game_info))
     if len(game_info.current_disasters) > 1 and len(game_info.deck) >= len(
         game_info.current_disasters
     ):
-        # Shuffle back all but the first dealt disaster
-        game_info.deck.extend(game_info.shop + game_info.current_disasters[1:])
+        # Shuffle back all but the first dealt disaster. The rest of the
+        # deck is already shuffled, so only the returned cards need placing.
+        returned = game_info.shop + [
+            cards.encode_card(card) for card in game_info.current_disasters[1:]
+        ]
+        cards.insert_random(game_info.deck, returned, game_info.rng)
         game_info.current_disasters = game_info.current_disasters[0:1]
         game_info.shop = []
-        random.shuffle(game_info.deck)
         # Redeal shop
-        while len(game_info.shop) < SHOP_SIZE:
-            if len(game_info.deck) > 0:
-                card = game_info.deck.pop()
-            else:
-                # Randomly take from discard pile if deck is empty
-                discard_index = random.choice(range(len(game_info.discard)))
-                card = game_info.discard.pop(discard_index)
-            if card[0] == "d" or card[0] == "c":
-                game_info.current_disasters.append(card)
-            else:
-                game_info.shop.append(int(card))
-        game_info.discard = game_info.deck
+        while len(game_info.shop) < SHOP_SIZE and (
+            len(game_info.deck) > 0 or len(game_info.discard) > 0
+        ):
+            _deal_card(game_info, _draw_card(game_info))
     if len(game_info.current_disasters) > 0 and all_discard_complete(
         game_info
     ):
@@ -208,7 +260,7 @@ def restock_shop(game_info: Game) -> Game:
 
 
 def shuffle_turn_order(game_info: Game) -> Game:
-    random.shuffle(game_info.turn_order)
+    game_info.rng.shuffle(game_info.turn_order)
     return game_info
 
 
@@ -217,30 +269,38 @@ def create_game(
     num_disasters: int,
     num_catastrophes: int,
     num_safe: int,
+    seed: Optional[int] = None,
 ) -> Game:
     if num_safe < SHOP_SIZE:
         raise RuntimeError("At least the first shop must be safe")
 
+    rng = new_rng(seed)
     deck = []
     for room_id in ROOM_LIST:
         room = int(room_id)
         if room < THRONE_ROOM_ID_START:
             deck.append(room)
-    random.shuffle(deck)
+    rng.shuffle(deck)
     safe = deck[:num_safe]
     deck = deck[num_safe:]
-    disasters = []
-    catastrophes = []
+    disaster_cards = []
+    catastrophe_cards = []
     for card in DISASTER_LIST:
         if card[0] == "d":
-            disasters += [card]
+            disaster_cards += [card]
         elif card[0] == "c":
-            catastrophes += [card]
-    deck += random.sample(disasters, num_disasters) + random.sample(
-        catastrophes, num_catastrophes
-    )
-    random.shuffle(deck)
-    deck = deck + safe
+            catastrophe_cards += [card]
+    deck += [
+        disaster_cards[i]
+        for i in rng.choice(len(disaster_cards), num_disasters, replace=False)
+    ] + [
+        catastrophe_cards[i]
+        for i in rng.choice(
+            len(catastrophe_cards), num_catastrophes, replace=False
+        )
+    ]
+    rng.shuffle(deck)
+    deck = cards.card_array(deck + safe)
     shop = []
     while len(shop) < SHOP_SIZE:
         shop.append(deck.pop())
@@ -254,16 +314,17 @@ def create_game(
             [],
         )
     turn_order = [player_id for player_id in players_info]
-    random.shuffle(turn_order)
+    rng.shuffle(turn_order)
     return Game(
         players,
         turn_order,
         0,
         shop,
-        [],
+        cards.card_array([]),
         deck,
         num_disasters,
         num_catastrophes,
         [],
         [],
+        rng,
     )
@@ -1,53 +1,304 @@
+import os
+
 import numpy as np
 
-from typing import List, Tuple, Dict
+from array import array
+from contextlib import contextmanager
+
+from types import MappingProxyType
+from typing import List, Optional, Sequence, Set, Tuple, Dict, Mapping
 
+import cards
 from data.room_list import ROOM_LIST
 
 ALL_CONNECTIONS = " *dDxXmM"
 
+# Offsets of the top, right, bottom and left neighbours of a cell, in the
+# same order as the sides of a room's connection string
+SIDE_OFFSETS = ((0, -1), (1, 0), (0, 1), (-1, 0))
+
+# Indices into the link counts returned by Castle.num_connections
+DIAMOND, CROSS, MOON, WILD = range(4)
+
+ROTATIONS = (0, 90, 180, 270)
+
+# Default caps on Castle.discard_sets results and partial sets explored
+DISCARD_SETS_LIMIT = 20
+DISCARD_SETS_MAX_STATES = 5000
+
+
+def _link_kind(conn: str, adj_conn: str) -> int:
+    """
+    Kind of link formed by two facing connections, or -1 if none
+    """
+    if conn == "*" and adj_conn == "*":
+        return WILD
+    elif conn in "dD*" and adj_conn in "dD*":  # noqa: F632
+        return DIAMOND
+    elif conn in "xX*" and adj_conn in "xX*":  # noqa: F632
+        return CROSS
+    elif conn in "mM*" and adj_conn in "mM*":  # noqa: F632
+        return MOON
+    return -1
+
+
+def _load_room_catalog() -> Mapping[int, Mapping[str, str]]:
+    """
+    Validated, read-only view of ROOM_LIST keyed by integer room id
+    """
+    catalog = {}
+    for index in ROOM_LIST:
+        if not set(ROOM_LIST[index]["connections"]).issubset(ALL_CONNECTIONS):
+            raise RuntimeError("Invalid connections in room list")
+        catalog[int(index)] = MappingProxyType(dict(ROOM_LIST[index]))
+    return MappingProxyType(catalog)
+
+
+def _compile_room_connections() -> np.array:
+    """
+    Connector codes (indices into ALL_CONNECTIONS) indexed by
+    room id, rotation // 90 and side
+    """
+    table = np.zeros(
+        (max(ROOM_CATALOG) + 1, len(ROTATIONS), 4), dtype=np.int8
+    )
+    for room_id in ROOM_CATALOG:
+        connections = ROOM_CATALOG[room_id]["connections"]
+        codes = [ALL_CONNECTIONS.find(c) for c in connections]
+        for rotate_num in range(len(ROTATIONS)):
+            for side in range(4):
+                table[room_id, rotate_num, side] = codes[
+                    (side - rotate_num) % 4
+                ]
+    return table
+
+
+# Validated once per process and shared by every Castle
+ROOM_CATALOG = _load_room_catalog()
+# Compiled once at import so adjacency checks are plain table lookups
+ROOM_CONNECTIONS = _compile_room_connections()
+# Link kind formed by two facing connector codes, or -1 if none
+LINK_KINDS = np.array(
+    [[_link_kind(a, b) for b in ALL_CONNECTIONS] for a in ALL_CONNECTIONS],
+    dtype=np.int8,
+)
+# Facing connector codes are compatible if both or neither are open
+COMPATIBLE = np.array(
+    [
+        [(a == " ") == (b == " ") for b in ALL_CONNECTIONS]
+        for a in ALL_CONNECTIONS
+    ]
+)
+# Nested list copies for scalar lookups, which are faster than NumPy indexing
+_ROOM_SIDES = ROOM_CONNECTIONS.tolist()
+_LINK_KINDS = LINK_KINDS.tolist()
+_COMPATIBLE = COMPATIBLE.tolist()
+
+
+def rotation_index(rotation: int) -> int:
+    if rotation not in ROTATIONS:
+        raise RuntimeError(
+            "Invalid room rotation. Rotation is {}. ".format(rotation)
+            + "Can only be 0, 90, 180 and 270."
+        )
+    return rotation // 90
+
 
 class Castle:
+    # Cross-check the incrementally maintained link counts against a full
+    # recount on every num_connections call
+    debug_links = os.environ.get("DISASTLE_DEBUG_LINKS", "") not in ("", "0")
+
     @staticmethod
-    def from_json_obj(throne_room_id: int, from_json_obj: List[str]):
+    def from_json_obj(throne_room_id: int, from_json_obj):
+        """
+        Reads the sparse {room_id: [x, y, rotation]} encoding, or the
+        legacy dense list of [placed, x, y, rotation] rows
+        """
         castle = Castle(throne_room_id)
-        castle._data = np.array([[int(r) for r in li] for li in from_json_obj])
+        if isinstance(from_json_obj, dict):
+            castle._data[throne_room_id] = 0
+            for room_id in from_json_obj:
+                x, y, rotation = from_json_obj[room_id]
+                castle._data[int(room_id)] = [1, int(x), int(y), int(rotation)]
+        else:
+            castle._data = np.array(
+                [[int(r) for r in li] for li in from_json_obj]
+            )
+        castle._rebuild_index()
         return castle
 
-    def to_json_obj(self) -> List:
-        return self._data.tolist()
+    def to_json_obj(self) -> Dict[str, List[int]]:
+        """
+        Sparse encoding holding only the placed rooms
+        """
+        return {
+            str(room_id): self._data[room_id, 1:].tolist()
+            for room_id in self.all_rooms()
+        }
 
     def __init__(self, throne_room_id: int):
-        self.room_list = {}
-        for index in ROOM_LIST:
-            if not set(ROOM_LIST[index]["connections"]).issubset(
-                ALL_CONNECTIONS
-            ):
-                raise RuntimeError("Invalid connections in room list")
-            self.room_list[int(index)] = ROOM_LIST[index]
+        self.room_list = ROOM_CATALOG
 
         if throne_room_id not in self.room_list:
             raise KeyError("Throne room id not found in room list")
         self.throne_room_id = throne_room_id
 
-        self._data = np.zeros((len(self.room_list) + 1, 4), dtype=np.int)
+        self._data = np.zeros((len(self.room_list) + 1, 4), dtype=int)
         self._data[throne_room_id] = [1, 0, 0, 0]
+        # (x, y) -> id of the room placed there
+        self._coords: Dict[Tuple[int, int], int] = {(0, 0): throne_room_id}
+        # Diamond, cross, moon and wild link counts
+        self._links = [0, 0, 0, 0]
+        # room_id -> ids of the rooms it is connected to
+        self._adjacent: Dict[int, Set[int]] = {throne_room_id: set()}
+        # Bumped on every row write, used to invalidate derived indexes
+        self.version = 0
+        # Previous (room_id, placed, x, y, rotation) of every row written
+        # while a checkpoint is open, newest last
+        self._undo: List[Tuple[int, int, int, int, int]] = []
+        self._open_checkpoints = 0
+
+    def _rebuild_index(self):
+        self._coords = {}
+        self._links = [0, 0, 0, 0]
+        self._adjacent = {}
+        for room_id in self.all_rooms().tolist():
+            x, y = self._data[room_id, 1:3].tolist()
+            self._coords[(x, y)] = room_id
+            self._update_links(room_id, 1)
+        self.version += 1
+
+    def _update_links(self, room_id: int, delta: int):
+        """
+        Adds (delta 1) or drops (delta -1) the links and connections the
+        placed room forms with its neighbours
+        """
+        x, y = self._data[room_id, 1:3]
+        sides = self._sides(room_id)
+        if delta > 0:
+            adjacent = self._adjacent[room_id] = set()
+        else:
+            adjacent = self._adjacent.pop(room_id)
+        for i, adj_id in self.neighbors(int(x), int(y)):
+            adj_conn = self._sides(adj_id)[(i + 2) % 4]
+            kind = _LINK_KINDS[sides[i]][adj_conn]
+            if kind >= 0:
+                self._links[kind] += delta
+            if sides[i] != 0 and adj_conn != 0:
+                if delta > 0:
+                    adjacent.add(adj_id)
+                    self._adjacent[adj_id].add(room_id)
+                else:
+                    self._adjacent[adj_id].discard(room_id)
+
+    def _sides(self, room_id: int) -> List[int]:
+        """
+        Connector codes of a placed room's top, right, bottom and left sides
+        """
+        return _ROOM_SIDES[room_id][self._data[room_id, 3] // 90]
+
+    def _write(self, room_id: int, placed: int, x: int, y: int, rot: int):
+        """
+        Sets a room's row, keeping the coordinate index and link counts
+        in sync and recording the old row if a checkpoint is open
+        """
+        old_placed, old_x, old_y, old_rot = self._data[room_id].tolist()
+        if self._open_checkpoints > 0:
+            self._undo.append((room_id, old_placed, old_x, old_y, old_rot))
+        self.version += 1
+        if old_placed > 0:
+            self._update_links(room_id, -1)
+            del self._coords[(old_x, old_y)]
+        self._data[room_id] = [placed, x, y, rot]
+        if placed > 0:
+            self._coords[(x, y)] = room_id
+            self._update_links(room_id, 1)
+
+    def checkpoint(self) -> int:
+        """
+        Starts recording mutations so they can be undone with rollback.
+        Checkpoints nest; each must be closed by rollback or commit.
+        """
+        self._open_checkpoints += 1
+        return len(self._undo)
+
+    def rollback(self, mark: int):
+        """
+        Undoes every mutation made since the checkpoint returned mark
+        """
+        undo = self._undo
+        self._open_checkpoints -= 1
+        opened = self._open_checkpoints
+        # Undo writes must not be recorded themselves
+        self._open_checkpoints = 0
+        while len(undo) > mark:
+            self._write(*undo.pop())
+        self._open_checkpoints = opened
+
+    def commit(self, mark: int):
+        """
+        Keeps the mutations made since the checkpoint returned mark. They
+        can still be undone by rolling back an enclosing checkpoint.
+        """
+        self._open_checkpoints -= 1
+        if self._open_checkpoints == 0:
+            self._undo.clear()
+
+    @contextmanager
+    def transaction(self):
+        """
+        Commits the mutations made in the block, or rolls them back if it
+        raises
+        """
+        mark = self.checkpoint()
+        try:
+            yield self
+        except BaseException:
+            self.rollback(mark)
+            raise
+        self.commit(mark)
+
+    @contextmanager
+    def trial(self):
+        """
+        Rolls back every mutation made in the block, for what-if checks
+        """
+        mark = self.checkpoint()
+        try:
+            yield self
+        finally:
+            self.rollback(mark)
+
+    def room_at(self, x: int, y: int) -> int:
+        """
+        Id of the room placed at (x, y), or 0 if the cell is empty
+        """
+        return self._coords.get((x, y), 0)
+
+    def neighbors(self, x: int, y: int) -> List[Tuple[int, int]]:
+        """
+        (side, room_id) of every placed room adjacent to (x, y)
+        """
+        result = []
+        for side, (dx, dy) in enumerate(SIDE_OFFSETS):
+            adj_id = self._coords.get((x + dx, y + dy))
+            if adj_id is not None:
+                result.append((side, adj_id))
+        return result
 
     def all_rooms(self) -> np.array:
         return (self._data[:, 0] > 0).nonzero()[0]
 
-    def get_rotated_connections(self, room_id: int, rotation: int):
-        if rotation not in [0, 90, 180, 270]:
-            raise RuntimeError(
-                "Invalid room rotation. Rotation is {}. ".format(rotation)
-                + "Can only be 0, 90, 180 and 270."
-            )
-        room_connections = self.room_list[room_id]["connections"]
-        rotate_num = rotation // 90
-        rotated_connections = (
-            room_connections[-rotate_num:] + room_connections[:-rotate_num]
-        )
-        return rotated_connections
+    def frontier(self) -> List[Tuple[int, int]]:
+        """
+        Empty cells adjacent to at least one placed room
+        """
+        cells = set()
+        for x, y in self._coords:
+            for dx, dy in SIDE_OFFSETS:
+                cells.add((x + dx, y + dy))
+        return [cell for cell in cells if cell not in self._coords]
 
     def place(self, room_id: int, x: int, y: int, rotation: int = 0):
         """
@@ -56,37 +307,53 @@ class Castle:
         """
         if self._data[room_id, 0] > 0:
             raise RuntimeError("Room already placed")
-        room_connections = self.get_rotated_connections(room_id, rotation)
-        adj_coords = [(x, y - 1), (x + 1, y), (x, y + 1), (x - 1), y]
+        if (x, y) in self._coords:
+            raise RuntimeError("Invalid room placement")
+        sides = _ROOM_SIDES[room_id][rotation_index(rotation)]
 
         connected = False
         valid_placement = True
         has_adj = False
-        for adj_id in self.all_rooms():
-            adj_coord = tuple(self._data[adj_id, 1:3])
-            adj_rot = self._data[adj_id, -1]
-            try:
-                i = adj_coords.index(adj_coord)
-                has_adj = True
-
-                conn = room_connections[i]
-                adj_room_connections = self.get_rotated_connections(
-                    adj_id, adj_rot
-                )
-                adj_conn = adj_room_connections[(i + 2) % 4]
-                if conn != " " and adj_conn != " ":
-                    connected = True
-                    continue
-                elif conn != " " or adj_conn != " ":
-                    valid_placement = False
-                    break
-            except ValueError:
-                # adj_id is not adjacent to room_id, skip
-                continue
+        for i, adj_id in self.neighbors(x, y):
+            has_adj = True
+            conn = sides[i]
+            adj_conn = self._sides(adj_id)[(i + 2) % 4]
+            if not _COMPATIBLE[conn][adj_conn]:
+                valid_placement = False
+                break
+            elif conn != 0:
+                connected = True
 
         if not valid_placement or not connected or not has_adj:
             raise RuntimeError("Invalid room placement")
-        self._data[room_id] = [1, x, y, rotation]
+        self._write(room_id, 1, x, y, rotation)
+
+    def legal_placements(self, room_id: int) -> List[Tuple[int, int, int]]:
+        """
+        Every (x, y, rotation) at which the unplaced room could be placed.
+        All frontier cells and rotations are checked at once against the
+        compiled connection tables.
+        """
+        if self._data[room_id, 0] > 0:
+            raise RuntimeError("Room already placed")
+        cells = self.frontier()
+        # Connector code each neighbour presents to the cell, -1 if none
+        facing = np.full((len(cells), 4), -1, dtype=np.int8)
+        for f, (x, y) in enumerate(cells):
+            for i, adj_id in self.neighbors(x, y):
+                facing[f, i] = self._sides(adj_id)[(i + 2) % 4]
+
+        has_adj = facing[:, None, :] >= 0
+        sides = ROOM_CONNECTIONS[room_id][None, :, :]
+        facing = np.maximum(facing, 0)[:, None, :]
+        # cells x rotations x sides
+        compatible = ~has_adj | COMPATIBLE[sides, facing]
+        connected = has_adj & (sides != 0) & (facing != 0)
+        legal = compatible.all(axis=2) & connected.any(axis=2)
+        return [
+            (cells[f][0], cells[f][1], ROTATIONS[r])
+            for f, r in zip(*legal.nonzero())
+        ]
 
     def remove(self, room_id: int):
         """
@@ -96,26 +363,36 @@ class Castle:
             raise RuntimeError(
                 "Room cannot be removed because it's not placed"
             )
-        self._data[room_id] = [0, 0, 0, 0]
+        self._write(room_id, 0, 0, 0, 0)
 
     def discard(self, *room_ids: int):
         """
         Save and checked removal of room from the castle.
         If multiple room_ids are inputted, it will be discarded sequentially
         """
-        backup_data = self._data.copy()
-        try:
-            for room_id in room_ids:
-                if not self.is_outer_room(room_id):
-                    raise RuntimeError("Room cannot be discarded")
-                self.remove(room_id)
-        except RuntimeError:
-            self._data = backup_data
-            raise RuntimeError("Discard room failed")
+        with self.transaction():
+            try:
+                for room_id in room_ids:
+                    if not self.is_outer_room(room_id):
+                        raise RuntimeError("Room cannot be discarded")
+                    self.remove(room_id)
+            except RuntimeError:
+                raise RuntimeError("Discard room failed")
 
     def copy(self):
-        copied = Castle(self.throne_room_id)
+        copied = Castle.__new__(Castle)
+        copied.room_list = self.room_list
+        copied.throne_room_id = self.throne_room_id
         copied._data = self._data.copy()
+        copied._coords = self._coords.copy()
+        copied._links = self._links.copy()
+        copied._adjacent = {
+            room_id: adjacent.copy()
+            for room_id, adjacent in self._adjacent.items()
+        }
+        copied.version = self.version
+        copied._undo = []
+        copied._open_checkpoints = 0
         return copied
 
     def swap(self, id_a: int, id_b: int, rot_a: int = 0, rot_b: int = 0):
@@ -123,66 +400,160 @@ class Castle:
         Checks for anything remove and place checks.
         Essenstially remove both rooms and place them back in swapped.
         """
-        backup_data = self._data.copy()
-        try:
-            self.remove(id_a)
-            self.remove(id_b)
-        except RuntimeError:
-            self._data = backup_data
-            raise RuntimeError(
-                "Rooms cannot be swapped because they are not placed"
-            )
-        try:
-            self.place(id_b, *backup_data[id_a][1:], rot_a)
-            self.place(id_a, *backup_data[id_b][1:], rot_b)
-        except RuntimeError:
-            self._data = backup_data
-            raise RuntimeError(
-                "Rooms cannot be swapped because their connections don't match"
-            )
+        x_a, y_a = self._data[id_a, 1:3].tolist()
+        x_b, y_b = self._data[id_b, 1:3].tolist()
+        with self.transaction():
+            try:
+                self.remove(id_a)
+                self.remove(id_b)
+            except RuntimeError:
+                raise RuntimeError(
+                    "Rooms cannot be swapped because they are not placed"
+                )
+            try:
+                self.place(id_b, x_a, y_a, rot_a)
+                self.place(id_a, x_b, y_b, rot_b)
+            except RuntimeError:
+                raise RuntimeError(
+                    "Rooms cannot be swapped because their connections "
+                    "don't match"
+                )
 
     def is_outer_room(self, room_id: int):
         if self._data[room_id, 0] == 0:
             raise RuntimeError("Room is not placed")
+        return len(self._adjacent[room_id]) == 1
+
+    def connected_rooms(self, room_id: int) -> Set[int]:
+        """
+        Rooms the placed room shares an open connection with
+        """
+        if self._data[room_id, 0] == 0:
+            raise RuntimeError("Room is not placed")
+        return self._adjacent[room_id]
+
+    def discardable_rooms(self) -> List[int]:
+        """
+        Rooms that can be discarded right now
+        """
+        return [
+            room_id
+            for room_id, adjacent in self._adjacent.items()
+            if len(adjacent) == 1
+        ]
+
+    def discard_order(self, room_ids: Sequence[int]) -> Optional[List[int]]:
+        """
+        An order in which all the rooms can be discarded one by one, or
+        None if the set cannot be discarded in any order.
+        Works in one pass by peeling rooms that are down to one connection.
+        """
+        discarding = set(room_ids)
+        if (
+            len(discarding) != len(room_ids)
+            or not discarding.issubset(self._adjacent)
+            or len(discarding) >= len(self._adjacent)
+        ):
+            return None
+        degree = {
+            room_id: len(self._adjacent[room_id]) for room_id in discarding
+        }
+        peelable = [room_id for room_id in discarding if degree[room_id] == 1]
+        order = []
+        while peelable:
+            room_id = peelable.pop()
+            if degree.pop(room_id) != 1:
+                continue
+            order.append(room_id)
+            for adj_id in self._adjacent[room_id]:
+                if adj_id in degree:
+                    degree[adj_id] -= 1
+                    if degree[adj_id] == 1:
+                        peelable.append(adj_id)
+        if len(order) != len(discarding):
+            return None
+        return order
+
+    def is_valid_discard(self, room_ids: Sequence[int]) -> bool:
+        return self.discard_order(room_ids) is not None
+
+    def _room_link_count(self, room_id: int) -> int:
         x, y = self._data[room_id, 1:3]
-        curr_rot = self._data[room_id, -1]
-        room_connections = self.get_rotated_connections(room_id, curr_rot)
-        adj_coords = [(x, y - 1), (x + 1, y), (x, y + 1), (x - 1), y]
-
-        connected_count = 0
-        for adj_id in self.all_rooms():
-            adj_coord = tuple(self._data[adj_id, 1:3])
-            adj_rot = self._data[adj_id, -1]
-            try:
-                i = adj_coords.index(adj_coord)
-                conn = room_connections[i]
-                adj_room_connections = self.get_rotated_connections(
-                    adj_id, adj_rot
-                )
-                adj_conn = adj_room_connections[(i + 2) % 4]
-                if conn != " " and adj_conn != " ":
-                    connected_count += 1
+        sides = self._sides(room_id)
+        return sum(
+            _LINK_KINDS[sides[i]][self._sides(adj_id)[(i + 2) % 4]] >= 0
+            for i, adj_id in self.neighbors(int(x), int(y))
+        )
+
+    def discard_sets(
+        self,
+        k: int,
+        limit: int = DISCARD_SETS_LIMIT,
+        max_states: int = DISCARD_SETS_MAX_STATES,
+    ) -> List[List[int]]:
+        """
+        Valid sets of k rooms to discard, each as a valid discard order,
+        best first: the sets that leave the most links standing.
+        Rooms are peeled cheapest first, each partial set is explored once,
+        and the search stops after limit sets or max_states partial sets.
+        """
+        if k <= 0 or k >= len(self._adjacent):
+            return []
+        adjacent = self._adjacent
+        link_count = {
+            room_id: self._room_link_count(room_id) for room_id in adjacent
+        }
+        degree = {room_id: len(adjacent[room_id]) for room_id in adjacent}
+        order: List[int] = []
+        seen: Set[frozenset] = set()
+        found: List[List[int]] = []
+
+        def extend():
+            if len(found) >= limit or len(seen) >= max_states:
+                return
+            if len(order) == k:
+                found.append(list(order))
+                return
+            leaves = sorted(
+                (r for r in degree if degree[r] == 1 and r not in order),
+                key=link_count.get,
+            )
+            for room_id in leaves:
+                key = frozenset(order + [room_id])
+                if key in seen:
                     continue
-            except ValueError:
-                # adj_id is not adjacent to room_id, skip
-                continue
-        return connected_count == 1
+                seen.add(key)
+                order.append(room_id)
+                for adj_id in adjacent[room_id]:
+                    degree[adj_id] -= 1
+                extend()
+                for adj_id in adjacent[room_id]:
+                    degree[adj_id] += 1
+                order.pop()
+
+        extend()
+        lost = []
+        for room_ids in found:
+            with self.trial():
+                for room_id in room_ids:
+                    self.remove(room_id)
+                lost.append(-sum(self._links))
+        return [room_ids for _, room_ids in sorted(zip(lost, found))]
 
     def rotate(self, room_id: int, rotation: int):
         if self._data[room_id, 0] == 0:
             raise RuntimeError(
                 "Room cannot be rotated because it's not placed"
             )
-        backup_data = self._data.copy()
-        self.remove(room_id)
-        try:
-            x, y = self._data[room_id, 1:3]
-            self.place(room_id, x, y, rotation)
-        except RuntimeError:
-            self._data = backup_data
-            raise RuntimeError(
-                "Rooms cannot be rotated because connections don't match"
-            )
+        x, y = self._data[room_id, 1:3].tolist()
+        with self.transaction():
+            self.remove(room_id)
+            try:
+                self.place(room_id, x, y, rotation)
+            except RuntimeError:
+                raise RuntimeError(
+                    "Rooms cannot be rotated because connections don't match"
+                )
 
     def move(self, room_id: int, x: int, y: int, rotation: int = 0):
         """
@@ -194,53 +565,81 @@ class Castle:
             raise RuntimeError(
                 "Room cannot be moved because it isn't an outer room"
             )
-        backup_data = self._data.copy()
-        self.remove(room_id)
-        try:
-            self.place(room_id, x, y, rotation)
-        except RuntimeError:
-            self._data = backup_data
-            raise RuntimeError(
-                "Rooms cannot be moved because connections don't match"
-            )
+        with self.transaction():
+            self.remove(room_id)
+            try:
+                self.place(room_id, x, y, rotation)
+            except RuntimeError:
+                raise RuntimeError(
+                    "Rooms cannot be moved because connections don't match"
+                )
 
     def num_connections(self) -> Tuple[int, int, int, int]:
-        diamond = 0
-        cross = 0
-        moon = 0
-        wild = 0
+        diamond, cross, moon, wild = self._links
+        if self.debug_links:
+            recounted = self.count_connections()
+            if recounted != (diamond, cross, moon, wild):
+                raise RuntimeError(
+                    "Link counts out of sync. Tracked {}, counted {}".format(
+                        tuple(self._links), recounted
+                    )
+                )
+        return diamond, cross, moon, wild
+
+    def count_connections(self) -> Tuple[int, int, int, int]:
+        """
+        Recounts every link in the castle from scratch
+        """
+        links = [0, 0, 0, 0]
         for room_id in self.all_rooms():
             x, y = self._data[room_id, 1:3]
-            curr_rot = self._data[room_id, -1]
-            room_connections = self.get_rotated_connections(room_id, curr_rot)
-            adj_coords = [(x, y - 1), (x + 1, y), (x, y + 1), (x - 1), y]
-
-            for adj_id in self.all_rooms():
-                adj_coord = tuple(self._data[adj_id, 1:3])
-                adj_rot = self._data[adj_id, -1]
-                try:
-                    i = adj_coords.index(adj_coord)
-                    conn = room_connections[i]
-                    adj_room_connections = self.get_rotated_connections(
-                        adj_id, adj_rot
-                    )
-                    adj_conn = adj_room_connections[(i + 2) % 4]
-                    if conn == "*" and adj_conn == "*":
-                        wild += 1
-                    elif conn in "dD*" and adj_conn in "dD*":  # noqa: F632
-                        diamond += 1
-                    elif conn in "xX*" and adj_conn in "xX*":  # noqa: F632
-                        cross += 1
-                    elif conn in "mM*" and adj_conn in "mM*":  # noqa: F632
-                        moon += 1
-                except ValueError:
-                    # adj_id is not adjacent to room_id, skip
-                    continue
+            sides = self._sides(room_id)
+
+            for i, adj_id in self.neighbors(int(x), int(y)):
+                kind = _LINK_KINDS[sides[i]][self._sides(adj_id)[(i + 2) % 4]]
+                if kind >= 0:
+                    links[kind] += 1
+        diamond, cross, moon, wild = links
         return diamond // 2, cross // 2, moon // 2, wild // 2
 
 
+def new_rng(seed: Optional[int] = None) -> np.random.Generator:
+    """
+    Game RNG, seeded from the OS if no seed is given
+    """
+    return np.random.Generator(np.random.PCG64(seed))
+
+
+def rng_to_json_obj(rng: np.random.Generator) -> Dict[str, str]:
+    """
+    PCG64 state as strings, since it holds 128-bit integers
+    """
+    state = rng.bit_generator.state
+    return {
+        "state": str(state["state"]["state"]),
+        "inc": str(state["state"]["inc"]),
+        "has_uint32": str(state["has_uint32"]),
+        "uinteger": str(state["uinteger"]),
+    }
+
+
+def rng_from_json_obj(json_obj: Dict[str, str]) -> np.random.Generator:
+    rng = new_rng()
+    rng.bit_generator.state = {
+        "bit_generator": "PCG64",
+        "state": {
+            "state": int(json_obj["state"]),
+            "inc": int(json_obj["inc"]),
+        },
+        "has_uint32": int(json_obj["has_uint32"]),
+        "uinteger": int(json_obj["uinteger"]),
+    }
+    return rng
+
+
 class Player:
-    def from_json_obj(self, json_obj):
+    @staticmethod
+    def from_json_obj(json_obj):
         discard_list = [int(c) for c in json_obj["discard_list"]]
         return Player(
             json_obj["username"],
@@ -268,21 +667,27 @@ class Game:
     def from_json_obj(json_obj: dict):
         players = {}
         for player_id in json_obj["players"]:
-            players[player_id] = Player(json_obj["players"][player_id])
-        turn_order = [int(t) for t in json_obj["turn_order"]]
+            players[player_id] = Player.from_json_obj(
+                json_obj["players"][player_id]
+            )
+        turn_order = [str(t) for t in json_obj["turn_order"]]
         shop = [int(t) for t in json_obj["shop"]]
-        discard = [int(t) for t in json_obj["discard"]]
+        discard = cards.card_array(json_obj["discard"])
         game = Game(
             players,
             turn_order,
             int(json_obj["turn_index"]),
             shop,
             discard,
-            json_obj["deck"],
+            cards.card_array(json_obj["deck"]),
             int(json_obj["num_disasters"]),
             int(json_obj["num_catastrophes"]),
             json_obj["current_disasters"],
             json_obj["previous_disasters"],
+            # Games stored before the RNG was persisted get a fresh one
+            rng_from_json_obj(json_obj["rng_state"])
+            if "rng_state" in json_obj
+            else None,
         )
         return game
 
@@ -295,12 +700,13 @@ class Game:
             "turn_order": self.turn_order,
             "turn_index": self.turn_index,
             "shop": self.shop,
-            "discard": self.discard,
-            "deck": self.deck,
+            "discard": cards.decode_cards(self.discard),
+            "deck": cards.decode_cards(self.deck),
             "num_disasters": self.num_disasters,
-            "num_catastrophes": self.num_disasters,
+            "num_catastrophes": self.num_catastrophes,
             "current_disasters": self.current_disasters,
             "previous_disasters": self.previous_disasters,
+            "rng_state": rng_to_json_obj(self.rng),
         }
 
     def to_public_json_obj(self) -> dict:
@@ -314,9 +720,9 @@ class Game:
             "players": players,
             "name_turn_order": turn_order,
             "shop": self.shop,
-            "discard": self.discard,
+            "discard": cards.decode_cards(self.discard),
             "num_disasters": self.num_disasters,
-            "num_catastrophes": self.num_disasters,
+            "num_catastrophes": self.num_catastrophes,
             "current_disasters": self.current_disasters,
             "previous_disasters": self.previous_disasters,
         }
@@ -327,12 +733,13 @@ class Game:
         turn_order: List[str],
         turn_index: int,
         shop: List[int],
-        discard: List[int],
-        deck: List[str],
+        discard: array,
+        deck: array,
         num_disasters: int,
         num_catastrophes: int,
         current_disasters: List[str],
         previous_disasters: List[str],
+        rng: Optional[np.random.Generator] = None,
     ):
         self.players: Dict[str, Player] = players
         self.turn_order = turn_order
@@ -344,3 +751,9 @@ class Game:
         self.num_catastrophes = num_catastrophes
         self.current_disasters = current_disasters
         self.previous_disasters = previous_disasters
+        # All dealing and shuffling draws from this, so a game replays
+        # identically from its stored state
+        self.rng = rng if rng is not None else new_rng()
+        # player_id -> (manager._damage_key, damage) of the last damage
+        # computed for that player
+        self.damage_cache: Dict[str, Tuple[tuple, int]] = {}
@@ -0,0 +1,127 @@
+import random
+import unittest
+
+from model import ROTATIONS, Castle
+
+THRONE_ROOM_ID = 101
+
+
+def build_castle(num_rooms: int, seed: int) -> Castle:
+    rng = random.Random(seed)
+    castle = Castle(THRONE_ROOM_ID)
+    candidates = list(range(1, THRONE_ROOM_ID))
+    rng.shuffle(candidates)
+    for room_id in candidates:
+        if len(castle.all_rooms()) > num_rooms:
+            break
+        placements = castle.legal_placements(room_id)
+        if placements:
+            castle.place(room_id, *rng.choice(placements))
+    return castle
+
+
+def state(castle: Castle) -> tuple:
+    return (
+        castle._data.tolist(),
+        dict(castle._coords),
+        list(castle._links),
+        {room_id: set(adj) for room_id, adj in castle._adjacent.items()},
+    )
+
+
+class TestCastle(unittest.TestCase):
+    def assertIndexesInSync(self, castle: Castle):
+        self.assertEqual(castle.num_connections(), castle.count_connections())
+        rebuilt = castle.copy()
+        rebuilt._rebuild_index()
+        self.assertEqual(state(castle), state(rebuilt))
+        for room_id, adjacent in castle._adjacent.items():
+            for adj_id in adjacent:
+                self.assertIn(room_id, castle._adjacent[adj_id])
+
+    def test_indexes_follow_every_mutation(self):
+        rng = random.Random(0)
+        for seed in range(5):
+            castle = build_castle(15, seed)
+            self.assertIndexesInSync(castle)
+            for _ in range(20):
+                rooms = [
+                    room_id
+                    for room_id in castle.discardable_rooms()
+                    if room_id != castle.throne_room_id
+                ]
+                if not rooms:
+                    break
+                room_id = rng.choice(rooms)
+                try:
+                    castle.rotate(room_id, rng.choice(ROTATIONS))
+                except RuntimeError:
+                    castle.discard(room_id)
+                self.assertIndexesInSync(castle)
+
+    def test_trial_rolls_back(self):
+        castle = build_castle(10, 1)
+        before = state(castle)
+        with castle.trial():
+            for room_id in castle.discardable_rooms():
+                if room_id != castle.throne_room_id:
+                    castle.remove(room_id)
+        self.assertEqual(state(castle), before)
+        self.assertEqual(castle._open_checkpoints, 0)
+        self.assertEqual(castle._undo, [])
+
+    def test_nested_transaction_is_undone_by_outer_rollback(self):
+        castle = build_castle(10, 2)
+        before = state(castle)
+        room_id = next(
+            r for r in castle.discardable_rooms() if r != THRONE_ROOM_ID
+        )
+        with castle.trial():
+            castle.discard(room_id)
+            self.assertNotIn(room_id, castle.all_rooms())
+        self.assertEqual(state(castle), before)
+
+    def test_failed_mutations_change_nothing(self):
+        castle = build_castle(10, 3)
+        before = state(castle)
+        for mutate in (
+            lambda: castle.discard(THRONE_ROOM_ID),
+            lambda: castle.discard(999),
+            lambda: castle.swap(THRONE_ROOM_ID, 999),
+            lambda: castle.place(1, 0, 0),
+            lambda: castle.move(THRONE_ROOM_ID, 5, 5),
+        ):
+            with self.assertRaises((RuntimeError, IndexError)):
+                mutate()
+            self.assertEqual(state(castle), before)
+            self.assertEqual(castle._open_checkpoints, 0)
+
+    def test_copy_is_independent(self):
+        castle = build_castle(10, 4)
+        copied = castle.copy()
+        before = state(castle)
+        for room_id in copied.discardable_rooms():
+            if room_id != THRONE_ROOM_ID:
+                copied.discard(room_id)
+        self.assertEqual(state(castle), before)
+        self.assertIndexesInSync(copied)
+
+    def test_discard_order_matches_discard(self):
+        castle = build_castle(12, 5)
+        discard_sets = castle.discard_sets(3)
+        self.assertGreater(len(discard_sets), 0)
+        for room_ids in discard_sets:
+            order = castle.discard_order(list(reversed(room_ids)))
+            self.assertIsNotNone(order)
+            with castle.trial():
+                castle.discard(*order)
+        self.assertIsNone(castle.discard_order([THRONE_ROOM_ID]))
+
+    def test_json_round_trip(self):
+        castle = build_castle(10, 6)
+        loaded = Castle.from_json_obj(THRONE_ROOM_ID, castle.to_json_obj())
+        self.assertEqual(state(loaded), state(castle))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,119 @@
+import json
+import logging
+import os
+import random
+import time
+
+from typing import Dict, Optional
+
+logger = logging.getLogger("disastle.request")
+
+# Fraction of requests logged, from 0 to 1. Failed requests are always
+# logged.
+LOG_SAMPLE_RATE = float(os.environ.get("LOG_SAMPLE_RATE", "1"))
+
+# Level each action is logged at. Polling actions are the bulk of the
+# traffic, so they are kept out of INFO logs by default. Overridden with
+# LOG_LEVELS, e.g. "GET_GAME_INFO=INFO,BOT_TURN=WARNING".
+ACTION_LOG_LEVELS = {
+    "GET_GAME_INFO": logging.DEBUG,
+    "GET_GAME_REPLAY": logging.DEBUG,
+}
+DEFAULT_LOG_LEVEL = logging.INFO
+
+# Event fields copied into the log line. Everything else, like usernames
+# and action arguments, is left out.
+LOGGED_FIELDS = ("action", "game_id", "player_id")
+
+
+def _parse_levels(spec: str) -> Dict[str, int]:
+    levels = {}
+    for entry in spec.split(","):
+        if "=" not in entry:
+            continue
+        action, name = entry.split("=", 1)
+        level = logging.getLevelName(name.strip().upper())
+        # getLevelName returns a string for unknown names
+        if isinstance(level, int):
+            levels[action.strip()] = level
+    return levels
+
+
+ACTION_LOG_LEVELS.update(_parse_levels(os.environ.get("LOG_LEVELS", "")))
+
+_cold_start = True
+
+
+class JsonLine:
+    """
+    Log message serialized only if a handler actually formats it
+    """
+
+    def __init__(self, fields: Dict):
+        self.fields = fields
+
+    def __str__(self) -> str:
+        return json.dumps(self.fields, separators=(",", ":"), default=str)
+
+
+class Request:
+    """
+    Times one invocation and decides up front whether it is logged, so
+    unsampled requests cost a clock read and a random draw
+    """
+
+    def __init__(self, event, context):
+        global _cold_start
+        self.event = event
+        self.context = context
+        self.start = time.perf_counter()
+        self.cold_start = _cold_start
+        _cold_start = False
+        action = event.get("action") if isinstance(event, dict) else None
+        if isinstance(action, str) and action in ACTION_LOG_LEVELS:
+            self.level = ACTION_LOG_LEVELS[action]
+        else:
+            self.level = DEFAULT_LOG_LEVEL
+        self.sampled = (
+            logger.isEnabledFor(self.level)
+            and random.random() < LOG_SAMPLE_RATE
+        )
+
+    def _fields(self, outcome: str, error: Optional[str] = None) -> Dict:
+        fields = {
+            key: self.event[key]
+            for key in LOGGED_FIELDS
+            if isinstance(self.event, dict) and key in self.event
+        }
+        fields["outcome"] = outcome
+        if error is not None:
+            fields["error"] = error
+        fields["duration_ms"] = round(
+            1000 * (time.perf_counter() - self.start), 2
+        )
+        fields["cold_start"] = self.cold_start
+        request_id = getattr(self.context, "aws_request_id", None)
+        if request_id is not None:
+            fields["request_id"] = request_id
+        if hasattr(self.context, "get_remaining_time_in_millis"):
+            remaining = self.context.get_remaining_time_in_millis()
+            fields["remaining_ms"] = remaining
+        return fields
+
+    def finish(self, result: Dict):
+        """
+        Logs the request if sampled. Rejected requests are logged with
+        their error code.
+        """
+        if self.sampled:
+            if "error" in result:
+                fields = self._fields("rejected", result["error"])
+            else:
+                fields = self._fields("ok")
+            logger.log(self.level, "%s", JsonLine(fields))
+
+    def fail(self):
+        """
+        Logs the exception being handled, whether sampled or not
+        """
+        logger.exception("%s", JsonLine(self._fields("error")))
@@ -0,0 +1,158 @@
+"""
+Import-time profile of the Lambda function, to keep cold starts within a
+budget. Imports it in fresh interpreters with python -X importtime and
+reports the milliseconds each top-level module adds.
+
+    $ python import_profile.py
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+FUNCTION_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "function"
+)
+
+# Modules imported at each cold-start stage: the handler module itself,
+# then the game engine the first game request loads on top of it
+STAGES = {
+    "init": ["lambda_function"],
+    "engine": ["action_log", "bot"],
+}
+# Cumulative milliseconds each stage may take. Measured with warm .pyc
+# files; a first import after deployment also pays for compilation.
+BUDGET_MS = {"init": 250, "engine": 120}
+RUNS = 5
+
+
+def _parse_line(line: str) -> Optional[Tuple[int, str, float]]:
+    """
+    (nesting depth, module, cumulative ms) of a -X importtime output line
+    """
+    if not line.startswith("import time:") or "cumulative" in line:
+        return None
+    _, cumulative, name = line[len("import time:") :].split("|")
+    depth = (len(name) - len(name.lstrip()) - 1) // 2
+    return depth, name.strip(), int(cumulative) / 1000
+
+
+def profile_once() -> Dict[str, Dict[str, Dict[str, float]]]:
+    """
+    Cumulative ms of each stage's modules and of their direct imports
+    """
+    code = ["import sys", "print('#stage', file=sys.stderr)"]
+    for stage, modules in STAGES.items():
+        code.append("import " + ", ".join(modules))
+        code.append("print('#stage {}', file=sys.stderr)".format(stage))
+    env = dict(os.environ)
+    env.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "\n".join(code)],
+        cwd=FUNCTION_DIR,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    # Interpreter startup is not part of any stage
+    lines = result.stderr.splitlines()
+    lines = lines[lines.index("#stage") + 1 :]
+    stages: Dict[str, Dict[str, Dict[str, float]]] = {}
+    modules: Dict[str, Dict[str, float]] = {}
+    children: Dict[str, float] = {}
+    for line in lines:
+        if line.startswith("#stage "):
+            stages[line.split()[1]] = modules
+            modules = {}
+            continue
+        entry = _parse_line(line)
+        if entry is None:
+            continue
+        depth, name, ms = entry
+        # Children are listed before the module importing them
+        if depth == 1:
+            children[name] = ms
+        elif depth == 0:
+            modules[name] = dict(children, total=ms)
+            children = {}
+    return stages
+
+
+def profile(runs: int = RUNS) -> Dict:
+    """
+    Median of runs profiles, with each stage's total and budget
+    """
+    samples: Dict[str, Dict[str, Dict[str, List[float]]]] = defaultdict(
+        lambda: defaultdict(lambda: defaultdict(list))
+    )
+    for _ in range(runs):
+        for stage, modules in profile_once().items():
+            for name, times in modules.items():
+                for key, ms in times.items():
+                    samples[stage][name][key].append(ms)
+    report = {}
+    for stage in STAGES:
+        modules = {}
+        for name, times in samples[stage].items():
+            medians = {
+                key: statistics.median(ms) for key, ms in times.items()
+            }
+            total = medians.pop("total")
+            modules[name] = {
+                "total_ms": total,
+                "imports": dict(
+                    sorted(medians.items(), key=lambda item: -item[1])
+                ),
+            }
+        report[stage] = {
+            "total_ms": sum(m["total_ms"] for m in modules.values()),
+            "budget_ms": BUDGET_MS[stage],
+            "modules": modules,
+        }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--runs", type=int, default=RUNS)
+    parser.add_argument(
+        "--top", type=int, default=8, help="imports listed per module"
+    )
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    report = profile(args.runs)
+    over = [
+        stage
+        for stage in report
+        if report[stage]["total_ms"] > report[stage]["budget_ms"]
+    ]
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        for stage, stats in report.items():
+            print(
+                "{}: {:.1f}ms of {}ms budget{}".format(
+                    stage,
+                    stats["total_ms"],
+                    stats["budget_ms"],
+                    "  OVER BUDGET" if stage in over else "",
+                )
+            )
+            for name, module in stats["modules"].items():
+                print("  {:<40} {:>8.1f}".format(name, module["total_ms"]))
+                imports = list(module["imports"].items())[: args.top]
+                for child, ms in imports:
+                    print("    {:<38} {:>8.1f}".format(child, ms))
+    if len(over) > 0:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+Estimates the DynamoDB item size of typical games with the sparse castle
+encoding against the legacy dense one.
+
+    $ python item_size.py
+"""
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "function"))
+
+from simulate import build_castle, new_game  # noqa: E402
+
+# Rooms placed in each castle at the stages measured
+STAGES = {"early": 3, "mid": 10, "late": 20}
+
+
+def dynamodb_size(value) -> int:
+    """
+    Approximate size in bytes DynamoDB bills for an attribute value
+    """
+    if isinstance(value, str):
+        return len(value.encode("utf-8"))
+    if isinstance(value, bool) or value is None:
+        return 1
+    if isinstance(value, (int, float)):
+        digits = len(str(abs(value)).replace(".", "").lstrip("0")) or 1
+        return (digits + 1) // 2 + 1
+    if isinstance(value, dict):
+        return 3 + sum(
+            len(key.encode("utf-8")) + 1 + dynamodb_size(value[key])
+            for key in value
+        )
+    return 3 + sum(1 + dynamodb_size(v) for v in value)
+
+
+def item_sizes(num_players: int, num_rooms: int, seed: int = 0):
+    """
+    (dense, sparse) item size of a game whose castles hold num_rooms rooms
+    """
+    rng = random.Random(seed)
+    game = new_game(num_players, seed)
+    for player in game.players.values():
+        build_castle(player.castle, num_rooms, rng)
+    item = game.to_json_obj()
+    sparse = dynamodb_size(item)
+    for player_id in game.players:
+        castle = game.players[player_id].castle
+        item["players"][player_id]["castle_list"] = castle._data.tolist()
+    dense = dynamodb_size(item)
+    return dense, sparse
+
+
+def main():
+    print("players  stage  dense(B)  sparse(B)  reduction")
+    for num_players in range(2, 7):
+        for stage in STAGES:
+            dense, sparse = item_sizes(num_players, STAGES[stage])
+            print(
+                "{:>7}  {:>5}  {:>8}  {:>9}  {:>8.1%}".format(
+                    num_players, stage, dense, sparse, 1 - sparse / dense
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
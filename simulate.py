@@ -0,0 +1,397 @@
+"""
+Headless self-play simulator for Disastle. Plays full games in-process
+through manager, with no DynamoDB, and reports throughput and time spent
+in each phase of the rules engine. The castles games end with are scored
+together in one batched pass for their links and disaster damage.
+
+    $ python simulate.py --games 1000 --players 4 --policy greedy
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "function"))
+
+import disasters  # noqa: E402
+import manager  # noqa: E402
+from batch import CastleBatch  # noqa: E402
+from model import ROTATIONS, Castle, Game  # noqa: E402
+
+# Lobby defaults used by lambda_function.create_lobby
+NUM_DISASTERS = 6
+NUM_CATASTROPHES = 0
+NUM_SAFE = 15
+# Safety net against games that can never end
+MAX_TURNS = 2000
+# Random swaps, of a room pair with random rotations, tried each turn
+SWAP_LIMIT = 8
+
+PHASES = ("decide", "shop", "move", "swap", "pass", "discard")
+
+
+def turn_candidates(
+    game: Game, player_id: str, rng: random.Random
+) -> List[tuple]:
+    """
+    Shop purchases, moves of outer rooms and random swaps open to the
+    player, as manager action arguments. Purchases come from legal
+    placements; moves and swaps may still turn out illegal.
+    """
+    castle = game.players[player_id].castle
+    candidates = [
+        ("shop", room_id, x, y, rotation)
+        for room_id in game.shop
+        for x, y, rotation in castle.legal_placements(room_id)
+    ]
+    for room_id in castle.discardable_rooms():
+        if room_id == castle.throne_room_id:
+            continue
+        with castle.trial():
+            castle.remove(room_id)
+            placements = castle.legal_placements(room_id)
+        for x, y, rotation in placements:
+            candidates.append(("move", room_id, x, y, rotation))
+    rooms = [
+        room_id
+        for room_id in castle.all_rooms().tolist()
+        if room_id != castle.throne_room_id
+    ]
+    if len(rooms) >= 2:
+        for _ in range(SWAP_LIMIT):
+            room_id_a, room_id_b = rng.sample(rooms, 2)
+            candidates.append(
+                (
+                    "swap",
+                    room_id_a,
+                    room_id_b,
+                    rng.choice(ROTATIONS),
+                    rng.choice(ROTATIONS),
+                )
+            )
+    return candidates
+
+
+def links_after(castle: Castle, action: tuple) -> Optional[int]:
+    """
+    Links the castle would have after the action, or None if it is illegal
+    """
+    apply = {"shop": castle.place, "move": castle.move, "swap": castle.swap}
+    try:
+        with castle.trial():
+            apply[action[0]](*action[1:])
+            return sum(castle.num_connections())
+    except RuntimeError:
+        return None
+
+
+class RandomPolicy:
+    """
+    Takes a random legal shop purchase, move or swap, and discards a random
+    valid set
+    """
+
+    def choose_turn(self, game: Game, player_id: str, rng: random.Random):
+        castle = game.players[player_id].castle
+        candidates = turn_candidates(game, player_id, rng)
+        rng.shuffle(candidates)
+        for action in candidates:
+            if action[0] == "shop" or links_after(castle, action) is not None:
+                return action
+        return None
+
+    def choose_discard(
+        self, game: Game, player_id: str, rng: random.Random
+    ) -> Optional[List[int]]:
+        options = manager.discard_options(game, player_id)
+        return rng.choice(options) if len(options) > 0 else None
+
+
+class GreedyPolicy(RandomPolicy):
+    """
+    Takes the shop purchase, move or swap that leaves the castle with the
+    most links, and discards the set that keeps the most links standing
+    """
+
+    def choose_turn(self, game: Game, player_id: str, rng: random.Random):
+        castle = game.players[player_id].castle
+        best = None
+        best_links = -1
+        for action in turn_candidates(game, player_id, rng):
+            links = links_after(castle, action)
+            if links is not None and links > best_links:
+                best = action
+                best_links = links
+        return best
+
+    def choose_discard(
+        self, game: Game, player_id: str, rng: random.Random
+    ) -> Optional[List[int]]:
+        options = manager.discard_options(game, player_id)
+        return options[0] if len(options) > 0 else None
+
+
+POLICIES = {"random": RandomPolicy, "greedy": GreedyPolicy}
+
+
+def players_info(num_players: int) -> Dict[str, Dict]:
+    """
+    Lobby players_info of num_players players, each with their own throne
+    room
+    """
+    return {
+        "player-{}".format(i): {
+            "username": "bot{}".format(i),
+            "throne_room_id": manager.THRONE_ROOM_ID_START + i,
+        }
+        for i in range(num_players)
+    }
+
+
+def new_game(num_players: int, seed: int) -> Game:
+    return manager.create_game(
+        players_info(num_players),
+        NUM_DISASTERS,
+        NUM_CATASTROPHES,
+        NUM_SAFE,
+        seed,
+    )
+
+
+def build_castle(castle: Castle, num_rooms: int, rng: random.Random):
+    """
+    Places num_rooms rooms, each at the legal spot that leaves the most
+    links, like a player building for disasters would
+    """
+    candidates = list(range(1, manager.THRONE_ROOM_ID_START))
+    rng.shuffle(candidates)
+    for room_id in candidates:
+        if len(castle.all_rooms()) > num_rooms:
+            break
+        placements = castle.legal_placements(room_id)
+        if len(placements) > 0:
+            best = max(
+                placements,
+                key=lambda p: links_after(castle, ("shop", room_id) + p),
+            )
+            castle.place(room_id, *best)
+
+
+def play_game(num_players: int, policy_name: str, seed: int) -> Dict:
+    """
+    Plays one game to the end and returns its outcome and timings. The rules
+    engine has no elimination yet, so a game in which a player cannot
+    discard enough rooms to cover a disaster ends as "stalled".
+    """
+    rng = random.Random(seed)
+    policy = POLICIES[policy_name]()
+    phase_time: Dict[str, float] = defaultdict(float)
+    phase_count: Dict[str, int] = defaultdict(int)
+
+    def timed(phase, fn, *args):
+        start = time.perf_counter()
+        result = fn(*args)
+        phase_time[phase] += time.perf_counter() - start
+        phase_count[phase] += 1
+        return result
+
+    game = new_game(num_players, seed)
+    turns = 0
+    outcome = "ended"
+    while not manager.is_game_ended(game):
+        if turns >= MAX_TURNS:
+            outcome = "turn_limit"
+            break
+        if len(game.current_disasters) > 0:
+            pending = [
+                player_id
+                for player_id in game.players
+                if manager.player_damage(game, player_id) > 0
+                and len(game.players[player_id].discard_list) == 0
+            ]
+            if len(pending) == 0:
+                game = manager.resolve_disaster(game)
+                continue
+            for player_id in pending:
+                discard_list = timed(
+                    "decide", policy.choose_discard, game, player_id, rng
+                )
+                if discard_list is None:
+                    outcome = "stalled"
+                    break
+                game = timed(
+                    "discard",
+                    manager.action_discard,
+                    game,
+                    player_id,
+                    discard_list,
+                )
+            if outcome == "stalled":
+                break
+            continue
+        player_id = game.turn_order[game.turn_index]
+        action = timed("decide", policy.choose_turn, game, player_id, rng)
+        if action is None:
+            game = timed("pass", manager.pass_turn, game)
+        else:
+            kind, *args = action
+            action_fn = getattr(manager, "action_" + kind)
+            game = timed(kind, action_fn, game, player_id, *args)
+        turns += 1
+    return {
+        "outcome": outcome,
+        "turns": turns,
+        "phase_time": dict(phase_time),
+        "phase_count": dict(phase_count),
+        # int16 fits every coordinate and keeps results small to pickle
+        "castles": np.stack(
+            [player.castle._data for player in game.players.values()]
+        ).astype(np.int16),
+    }
+
+
+def _play_games(args) -> List[Dict]:
+    num_players, policy_name, seeds = args
+    return [play_game(num_players, policy_name, seed) for seed in seeds]
+
+
+def simulate(
+    games: int,
+    num_players: int,
+    policy_name: str,
+    workers: int,
+    seed: int = 0,
+) -> Dict:
+    """
+    Plays games across workers processes (in-process if workers is 0) and
+    aggregates throughput and per-phase timing
+    """
+    seeds = list(range(seed, seed + games))
+    start = time.perf_counter()
+    if workers == 0:
+        results = _play_games((num_players, policy_name, seeds))
+    else:
+        chunks = [
+            (num_players, policy_name, seeds[i::workers])
+            for i in range(workers)
+        ]
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = [
+                result
+                for chunk in pool.map(_play_games, chunks)
+                for result in chunk
+            ]
+    elapsed = time.perf_counter() - start
+
+    outcomes: Dict[str, int] = defaultdict(int)
+    phase_time: Dict[str, float] = defaultdict(float)
+    phase_count: Dict[str, int] = defaultdict(int)
+    turns = 0
+    for result in results:
+        outcomes[result["outcome"]] += 1
+        turns += result["turns"]
+        for phase in result["phase_time"]:
+            phase_time[phase] += result["phase_time"][phase]
+            phase_count[phase] += result["phase_count"][phase]
+    castles = CastleBatch(
+        np.concatenate([result["castles"] for result in results])
+    )
+    links = castles.link_counts()
+    # Damage of every disaster to every final castle, as a first disaster
+    damage = disasters.damage_table(links, [0])
+    return {
+        "games": games,
+        "players": num_players,
+        "policy": policy_name,
+        "workers": workers,
+        "seconds": elapsed,
+        "games_per_sec": games / elapsed,
+        "turns_per_sec": turns / elapsed,
+        "outcomes": dict(outcomes),
+        "castles": {
+            "count": len(castles),
+            "mean_links": dict(
+                zip(
+                    ("diamond", "cross", "moon", "wild"),
+                    links.mean(axis=0).tolist(),
+                )
+            ),
+            "mean_damage": float(damage.mean()),
+        },
+        "phases": {
+            phase: {
+                "calls": phase_count[phase],
+                "seconds": phase_time[phase],
+                "mean_us": 1e6 * phase_time[phase] / phase_count[phase],
+            }
+            for phase in PHASES
+            if phase_count[phase] > 0
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--games", type=int, default=100)
+    parser.add_argument("--players", type=int, default=4)
+    parser.add_argument("--policy", choices=POLICIES, default="random")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count(),
+        help="processes to spread games over, 0 to play in-process",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    report = simulate(
+        args.games, args.players, args.policy, args.workers, args.seed
+    )
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    print(
+        "{games} games, {players} players, {policy} policy, "
+        "{workers} workers in {seconds:.2f}s".format(**report)
+    )
+    print(
+        "{games_per_sec:.1f} games/sec, {turns_per_sec:.0f} turns/sec".format(
+            **report
+        )
+    )
+    print("outcomes: {}".format(report["outcomes"]))
+    castles = report["castles"]
+    print(
+        "{} final castles: mean links {}, mean disaster damage {:.2f}".format(
+            castles["count"],
+            ", ".join(
+                "{} {:.1f}".format(kind, mean)
+                for kind, mean in castles["mean_links"].items()
+            ),
+            castles["mean_damage"],
+        )
+    )
+    print(
+        "{:<8} {:>8} {:>10} {:>10}".format(
+            "phase", "calls", "total(s)", "mean(us)"
+        )
+    )
+    for phase, stats in report["phases"].items():
+        print(
+            "{:<8} {:>8} {:>10.3f} {:>10.1f}".format(
+                phase, stats["calls"], stats["seconds"], stats["mean_us"]
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()